@@ -3,21 +3,34 @@ import random
 import os
 import pandas as pd
 from glob import glob
-from st_files_connection import FilesConnection
 import io
 from PIL import Image
 from collections import Counter
 from time import time
 import re
 import yaml
-import time
+import scheduling
+import session
+import write_behind
+import storage
+import io_accounting
+import image_manifest
+import image_cache
+import image_loader
+import image_urls
+import state_store
+import metrics
+import catalog
+import question_tree
 
 st.set_page_config(layout="wide")
-conn = st.connection("gcs", type=FilesConnection)
+fs = io_accounting.AccountingStorage(storage.from_config())
 
 LANGUAGE = "en"
 TASK_NAME = f"visual_evidence_head_{LANGUAGE}"
 NOTES = "annotation-experiment/data/multimodal_tweets_balanced.csv"
+# Parquet catalog of NOTES, built with catalog.py; NOTES is read if it is missing
+NOTES_CATALOG = "annotation-experiment/data/multimodal_tweets_balanced"
 DEEPEST_NODE = 5
 
 DONE_CODE = "CV8TK0ZL"
@@ -32,10 +45,20 @@ QUALIFICATION_IMAGE_FOLDER = "annotation-experiment/static/qualification_images/
 QUESTION_TREE = "annotation-experiment/static/question_tree.yaml"
 MAX_ANNOTATIONS_PER_WORKER = 10  # TODO: adjust as needed
 ID_COL = "tweet_id"
+NOTES_COLUMNS = [ID_COL, "image_name", "full_text", "note"]
 IMAGE_FOLDER = "annotation-experiment/static/resized_images/"
+IMAGE_MANIFEST = "annotation-experiment/static/image_manifest.csv"
 PROGRESS_FOLDER = f"annotation-experiment/data/worker_progress/{TASK_NAME}"
 DONE_FILE = f"annotation-experiment/data/done_{TASK_NAME}.txt"
-NON_PARTICIPANTS_FILE = "annotation-experiment/data/non_participants.txt"
+NON_PARTICIPANTS_FOLDER = "annotation-experiment/data/non_participants/"
+SPOOL_FOLDER = f"data/pending_writes/{TASK_NAME}"
+STATE_BACKEND = os.environ.get("ANNOTATION_STATE", "bucket")  # or "sqlite"
+STATE_DB = f"data/state_{TASK_NAME}.sqlite"
+METRICS_LOG = f"data/metrics_{TASK_NAME}.jsonl"
+CONFIRM_IO_BUDGET = {"writes": 2, "full_reads": 0}  # per confirm, see io_accounting.py
+IMAGE_CACHE_MB = int(os.environ.get("IMAGE_CACHE_MB", 256))
+IMAGE_SERVING = os.environ.get("IMAGE_SERVING", "bytes")  # or "signed", "static"
+IMAGE_BASE_URL = os.environ.get("IMAGE_BASE_URL", "http://localhost:8502/")
 NUM_ANNOTATORS_PER_ITEM = 6  # TODO: adjust as needed
 
 
@@ -132,10 +155,10 @@ def timeit(start_time):
     return int(time() * 1000) - start_time
 
 
-def append_to_file(item: str, file_path: str):
-    done = conn.fs.open(file_path, "r").read()
-    done += f"{item}\n"
-    conn.fs.open(file_path, "w").write(done)
+def record_timing(phase: str, start_time):
+    metrics.open_metrics(METRICS_LOG).record(
+        phase, timeit(start_time), worker_id=st.session_state.get("worker_id")
+    )
 
 
 @st.cache_data
@@ -161,19 +184,33 @@ def remove_links(text: str):
 def record_non_participation():
     if not st.session_state.worker_id:
         return
-    if conn.fs.exists(NON_PARTICIPANTS_FILE):
-        append_to_file(st.session_state.worker_id, NON_PARTICIPANTS_FILE)
-    else:
-        conn.fs.open(NON_PARTICIPANTS_FILE, "w").write(
-            f"{st.session_state.worker_id}\n"
-        )
+    session.record_consent(
+        fs,
+        load_state_store(),
+        NON_PARTICIPANTS_FOLDER,
+        st.session_state.worker_id,
+        "No",
+    )
     st.success("Your choice has been recorded. Thank you.")
 
 
+def record_participation():
+    if st.session_state.get("consent_recorded"):
+        return
+    session.record_consent(
+        fs,
+        load_state_store(),
+        NON_PARTICIPANTS_FOLDER,
+        st.session_state.worker_id,
+        "Yes",
+    )
+    st.session_state.consent_recorded = True
+
+
 @st.cache_resource
-def load_question_tree() -> dict:
-    file = conn.fs.open(QUESTION_TREE, "r")
-    question_tree = yaml.safe_load(file)
+def load_question_tree() -> question_tree.QuestionTree:
+    file = fs.open(QUESTION_TREE, "r")
+    tree = yaml.safe_load(file)
 
     # replace boolean keys with "yes" and "no"
     def replace_bool_keys(d):
@@ -191,16 +228,22 @@ def load_question_tree() -> dict:
         else:
             return d
 
-    question_tree = replace_bool_keys(question_tree)
-    return question_tree
+    tree = replace_bool_keys(tree)
+    return question_tree.QuestionTree(tree, DEEPEST_NODE)
+
+
+@st.cache_resource
+def load_image_manifest() -> pd.DataFrame:
+    return image_manifest.load_manifest(fs, IMAGE_MANIFEST)
 
 
 @st.cache_resource
 def load_qualification_notes() -> pd.DataFrame:
-    notes = conn.fs.open(QUALIFICATION_NOTES, "r").read()
+    notes = fs.open(QUALIFICATION_NOTES, "r").read()
     notes = pd.read_csv(io.StringIO(notes))
-    images = conn.fs.glob(f"{QUALIFICATION_IMAGE_FOLDER}*.jpeg")
-    image_names = [os.path.basename(img) for img in images]
+    image_names = image_manifest.list_images(
+        fs, load_image_manifest(), QUALIFICATION_IMAGE_FOLDER, ".jpeg"
+    )
     notes = notes[notes["image_name"].isin(image_names)]
     notes = notes.drop_duplicates(subset=["image_name"])
     notes.set_index(ID_COL, inplace=True, drop=False)
@@ -209,16 +252,18 @@ def load_qualification_notes() -> pd.DataFrame:
 
 @st.cache_resource
 def load_notes() -> pd.DataFrame:
-    notes = conn.fs.open(NOTES, "r").read()
-    notes = pd.read_csv(io.StringIO(notes))
-    notes = notes[notes["language_present"] == LANGUAGE]
-    # seed from worker_id
-    images = conn.fs.glob(f"{IMAGE_FOLDER}*.jpeg")
-    image_names = [os.path.basename(img) for img in images]
-    notes = notes[notes["image_name"].isin(image_names)]
-    notes = notes.drop_duplicates(subset=["image_name"])
-    if DEBUGGING:
-        notes = notes.head(NUM_NOTES_IN_DEBUGGING)
+    image_names = image_manifest.list_images(
+        fs, load_image_manifest(), IMAGE_FOLDER, ".jpeg"
+    )
+    notes = catalog.read_notes(
+        fs,
+        NOTES_CATALOG,
+        NOTES,
+        LANGUAGE,
+        columns=NOTES_COLUMNS,
+        image_names=image_names,
+        limit=NUM_NOTES_IN_DEBUGGING if DEBUGGING else None,
+    )
     notes.set_index(ID_COL, inplace=True, drop=False)
 
     if ADD_QUALIFICATIONS:
@@ -228,70 +273,104 @@ def load_notes() -> pd.DataFrame:
     return notes
 
 
-def load_done() -> set:
-    if not conn.fs.exists(DONE_FILE):
-        conn.fs.open(DONE_FILE, "w").write("")
-        return set()
+@st.cache_resource
+def load_write_queue() -> write_behind.WriteBehindQueue:
+    return write_behind.WriteBehindQueue(fs.fs, spool_folder=SPOOL_FOLDER)
 
-    done = conn.fs.open(DONE_FILE, "r").read()
-    done = done.split("\n")
-    done = [d.strip() for d in done if d]
-    counts = Counter(done)
-    done = {d for d, c in counts.items() if c >= NUM_ANNOTATORS_PER_ITEM}
 
-    return done
+@st.cache_resource
+def load_state_store() -> state_store.StateStore:
+    if STATE_BACKEND == "sqlite":
+        return state_store.StateStore(STATE_DB)
+    return None  # the state is kept in the bucket
 
 
-@st.cache_data
-def load_images(image_names) -> list:
-    images = dict()
-    for image_name in image_names:
-        image_path = os.path.join(IMAGE_FOLDER, image_name)
-        image_data = conn.fs.open(image_path, "rb").read()
-        images[image_name] = image_data
-    return images
+@st.cache_resource
+def load_sessions() -> session.Sessions:
+    notes = load_notes()
+    if ADD_QUALIFICATIONS:
+        notes = notes[~notes["qualification"]]
+    return session.Sessions(
+        fs,
+        load_write_queue(),
+        load_state_store(),
+        ID_COL,
+        PROGRESS_FOLDER,
+        DONE_FILE,
+        NUM_ANNOTATORS_PER_ITEM,
+        catalog=notes.index.tolist(),
+    )
+
+
+def get_image_path(image_name: str) -> str:
+    return image_manifest.image_path(load_image_manifest(), image_name, IMAGE_FOLDER)
+
+
+def get_image_preview(image_name: str) -> bytes:
+    return image_manifest.preview(load_image_manifest(), image_name)
 
 
 @st.cache_resource
-def get_worker_session(worker_id: str, notes: pd.DataFrame) -> pd.DataFrame:
-    # check if a progress file exists for this worker
-    progress_file = f"{PROGRESS_FOLDER}/progress_{worker_id}.csv"
-    if conn.fs.exists(progress_file):
-        progress = conn.fs.open(progress_file, "r").read()
-        progress = pd.read_csv(io.StringIO(progress))
-        progress.set_index(ID_COL, inplace=True, drop=False)
-        return progress
-    else:
-        seed = hash(st.session_state.worker_id) % (2**31)
-        done_notes = load_done()
-        notes = notes[~notes.index.isin(done_notes)]
-
-        if ADD_QUALIFICATIONS:
-            qualifications = notes[notes["qualification"]]
-            non_qualifications = notes[~notes["qualification"]].sample(
-                n=min(MAX_ANNOTATIONS_PER_WORKER, len(notes)), random_state=seed
-            )
-            notes_to_label = pd.concat([qualifications, non_qualifications])
-            notes_to_label = notes_to_label.sample(frac=1, random_state=seed)
-        else:
-            notes_to_label = notes.sample(
-                n=min(MAX_ANNOTATIONS_PER_WORKER, len(notes)), random_state=seed
-            )
+def load_image_cache() -> image_cache.ImageCache:
+    return image_cache.ImageCache(IMAGE_CACHE_MB * 1024 * 1024)
 
-        ids_to_label = notes_to_label.index.tolist()
-        progress = pd.DataFrame(
-            {
-                ID_COL: ids_to_label,
-                "worker_id": [worker_id] * len(ids_to_label),
-                "done": [None] * len(ids_to_label),
-                "label": [None] * len(ids_to_label),
-                "image_name": notes_to_label["image_name"].tolist(),
-            }
-        )
-        progress.set_index(ID_COL, inplace=True, drop=False)
-        s = progress.to_csv(index=False)
-        conn.fs.open(progress_file, "w").write(s)
-        return progress
+
+@st.cache_resource
+def load_image_loader() -> image_loader.ImageLoader:
+    return image_loader.ImageLoader(fs, cache=load_image_cache())
+
+
+@st.cache_resource
+def load_signed_urls() -> image_urls.SignedURLs:
+    return image_urls.SignedURLs(fs)
+
+
+def image_url(image_name: str) -> str:
+    path = get_image_path(image_name)
+    if IMAGE_SERVING == "signed":
+        return load_signed_urls().url(path)
+    return image_urls.static_url(IMAGE_BASE_URL, path)
+
+
+def load_image(image_name: str, progress: pd.DataFrame) -> bytes:
+    """
+    Fetch the image of the current item and prefetch the next ones.
+    """
+    upcoming = progress.loc[progress["done"].isnull(), "image_name"]
+    upcoming = upcoming[upcoming != image_name].head(image_loader.LOOKAHEAD)
+    return load_image_loader().get(
+        get_image_path(image_name), lookahead=[get_image_path(n) for n in upcoming]
+    )
+
+
+def show_image(slot, image_data):
+    """
+    Paint the image in `slot`, or offer to try again if it couldn't be read.
+    """
+    if image_data is None:
+        with slot.container():
+            st.warning("The image couldn't be loaded.")
+            st.button("Try again", key="retry_image")
+        return
+    slot.image(image_data)
+
+
+def save_checkpoint(worker_id: str, item):
+    """
+    Save the answers given so far to `item` and the question the worker is at.
+    """
+    checkpoint = {
+        "cursor": st.session_state.cursor,
+        "labels": st.session_state.get("labels", []),
+    }
+    load_sessions().save_checkpoint(worker_id, item, checkpoint)
+
+
+@st.cache_resource
+def get_worker_session(worker_id: str, notes: pd.DataFrame) -> pd.DataFrame:
+    return load_sessions().start(
+        worker_id, notes, MAX_ANNOTATIONS_PER_WORKER, ADD_QUALIFICATIONS
+    )
 
 
 def get_item_number(progress: pd.DataFrame) -> int:
@@ -300,32 +379,33 @@ def get_item_number(progress: pd.DataFrame) -> int:
 
 
 def select_next_item_for_worker_id(progress: pd.DataFrame) -> str:
-    # select the next item that is not done
-    not_done = progress[progress["done"].isnull()]
-    if not_done.empty:
-        return None
-    next_id = not_done.index[0]
-    return next_id
+    return load_sessions().next_item(st.session_state.worker_id, progress)
+
+
+def no_items_available():
+    """
+    Stop the page when there is no work for the worker. There is no completion
+    code, so they return the study on Prolific instead of submitting it.
+    """
+    st.warning(
+        "All items have already been annotated by enough people, so there is"
+        " nothing left for you to annotate. Please return the study on Prolific."
+    )
+    st.stop()
 
 
 def clear_selections():
     """
     Clear all selections in the session state.
     """
-    for i in range(DEEPEST_NODE):
-        for type in ["image", "text", "text_in_image"]:
-            for suffix in ["", "_text", "_confirm"]:
-                key = f"{type}_question_{i}{suffix}"
-                if key in st.session_state:
-                    del st.session_state[key]
-
-    if "has_claim" in st.session_state:
-        del st.session_state["has_claim"]
-    if "has_claim_text" in st.session_state:
-        del st.session_state["has_claim_text"]
-    if "has_claim_confirm" in st.session_state:
-        del st.session_state["has_claim_confirm"]
+    for key in ["has_claim", "has_claim_text", "has_claim_confirm"]:
+        if key in st.session_state:
+            del st.session_state[key]
+    questions = load_question_tree()
+    st.session_state.cursor = questions.start()
+    reset_answer(questions.nodes[questions.start()])
     st.session_state.labels = []
+    st.session_state.pop("claim_confirmed", None)
 
 
 def collect_selected_labels() -> list:
@@ -350,7 +430,7 @@ def confirm_label(note: pd.Series):
     """
     Confirm the selected label and update the progress.
     """
-    progress_file = f"{PROGRESS_FOLDER}/progress_{st.session_state.worker_id}.csv"
+    time_start = time_before()
     selected_labels = collect_selected_labels()
 
     if not selected_labels:
@@ -360,42 +440,95 @@ def confirm_label(note: pd.Series):
     st.session_state.progress.at[index, "done"] = True
     st.session_state.progress.at[index, "label"] = str(selected_labels)
     clear_selections()
-    s = st.session_state.progress.to_csv(index=False)
-    conn.fs.open(progress_file, "w").write(s)
-    append_to_file(index, DONE_FILE)
+    load_sessions().save_answer(
+        st.session_state.worker_id,
+        index,
+        seq=st.session_state.progress["done"].notnull().sum(),
+        values={"done": True, "label": str(selected_labels)},
+    )
+    load_sessions().drop_checkpoint(st.session_state.worker_id, index)
+    record_timing("confirm", time_start)
 
 
-@st.cache_data
-def get_question(current_question):
-    question = current_question["question"]
-    possible_answers = current_question["answers"].keys()
-    possible_answers = list(possible_answers)
-    possible_answers = [s.capitalize() for s in possible_answers]
-    possible_answers.sort(reverse=True)
-    possible_next_questions = current_question["answers"]
-    return question, possible_answers, possible_next_questions
-
-
-def save_value(question, key):
-    if "labels" not in st.session_state:
-        st.session_state.labels = []
-    multi_choice_answer = st.session_state[key]
-    free_text_answer = st.session_state[f"{key}_text"]
-    st.session_state.labels.append((question, multi_choice_answer, free_text_answer))
-    st.session_state.question_counter += 1
-
-
-def is_mandatory_text(current_question):
-    is_mandatory = current_question["mandatory_text"]
-    if is_mandatory == False:
-        return "None"
-    return is_mandatory.split("-")[1]
-
-
-def is_multi_answers(current_question):
-    if "multiple_answers" in current_question:
-        return current_question["multiple_answers"]
-    return False
+def reset_answer(node: question_tree.Node):
+    """
+    Empty the answer widgets for `node`, the next question to show. The values
+    are set rather than deleted, so the browser drops the previous answer too.
+    """
+    st.session_state.answer = [] if node is not None and node.multi else None
+    st.session_state.answer_text = ""
+    st.session_state.answer_confirm = False
+
+
+def confirm_answer(node_id: str, item):
+    """
+    Save the answer to the current question and move the cursor to the next.
+    """
+    if st.session_state.get("cursor") != node_id:
+        return  # the box was unticked, or the answer is already saved
+    questions = load_question_tree()
+    answer = st.session_state.answer
+    st.session_state.setdefault("labels", []).append(
+        (questions.nodes[node_id].question, answer, st.session_state.answer_text)
+    )
+    st.session_state.cursor = questions.next(node_id, answer)
+    reset_answer(questions.nodes.get(st.session_state.cursor))
+    save_checkpoint(st.session_state.worker_id, item)
+
+
+def resume_item(item, questions: question_tree.QuestionTree):
+    """
+    Restore the answers to `item` checkpointed by an earlier connection of
+    the worker, if any, and put the cursor back where it was.
+    """
+    checkpoint = load_sessions().load_checkpoint(st.session_state.worker_id, item)
+    if checkpoint is None:
+        return
+    cursor = checkpoint["cursor"]
+    if cursor is not None and cursor not in questions.nodes:
+        return  # the question tree has changed since, start the item over
+    st.session_state.claim_confirmed = True
+    st.session_state.cursor = cursor
+    st.session_state.labels = [tuple(label) for label in checkpoint["labels"]]
+    reset_answer(questions.nodes.get(cursor))
+
+
+def render_question(node: question_tree.Node, item):
+    """
+    The widgets of one question of the tree, whatever its section. They use
+    the same few state keys for every question.
+    """
+    st.subheader(f"{len(st.session_state.get('labels', [])) + 1}) {node.title}")
+    st.markdown(f"**{node.question}**")
+    st.pills(
+        node.explanation,
+        node.answers,
+        selection_mode="multi" if node.multi else "single",
+        key="answer",
+        default=None,
+    )
+
+    if node.mandatory_text:
+        text_input_title = "Explain your choice **(required)**"
+    else:
+        text_input_title = "Explain your choice (optional)"
+
+    st.text_input(
+        text_input_title,
+        key="answer_text",
+        placeholder="",
+        disabled=not st.session_state.answer,
+        help="Please explain your choice in a few words.",
+    )
+    st.checkbox(
+        label="Confirm",
+        key="answer_confirm",
+        disabled=disable_confirm(
+            node.mandatory_text, st.session_state.answer, st.session_state.answer_text
+        ),
+        on_change=confirm_answer,
+        args=[node.id, item],
+    )
 
 
 def disable_confirm(mandatory_text, ans, text_ans):
@@ -408,6 +541,82 @@ def disable_confirm(mandatory_text, ans, text_ans):
     return False
 
 
+@st.fragment
+def question_panel(note: pd.Series, questions: question_tree.QuestionTree):
+    """
+    The questions about the item. It runs as a fragment, so answering a
+    question only reruns the panel, not the rest of the page.
+    """
+    st.divider()
+    # not a claim
+    placeholder = st.empty()
+    if not st.session_state.get("claim_confirmed"):
+        with placeholder.container():
+            st.markdown(
+                f"**Does the tweet and/or image make a claim? (either explicitly or implicitly)**"
+            )
+            st.pills(
+                "Select an answer:",
+                ["Yes", "No"],
+                selection_mode="single",
+                key="has_claim",
+                default=None,
+            )
+            st.text_input(
+                "If not, explain why",
+                key=f"has_claim_text",
+                placeholder="",
+                value=st.session_state.get(f"has_claim_text", ""),
+                disabled=st.session_state["has_claim"] != "No",
+                help="Please explain your choice in a few words.",
+            )
+            st.checkbox(
+                label="Confirm",
+                value=False,
+                key=f"has_claim_confirm",
+                disabled=(not st.session_state["has_claim"])
+                or (
+                    st.session_state["has_claim"] == "No"
+                    and not st.session_state["has_claim_text"]
+                ),
+            )
+            if not st.session_state["has_claim_confirm"]:
+                return
+            elif st.session_state["has_claim"] == "No":
+                count_confirm_io(note=note)
+                st.session_state["has_claim"] = None
+                st.session_state["has_claim_text"] = ""
+                st.session_state["has_claim_confirm"] = False
+                st.rerun()
+            # the claim widgets aren't shown again, so their state won't last
+            st.session_state.claim_confirmed = True
+            placeholder.empty()
+            if "cursor" not in st.session_state:
+                st.session_state.cursor = questions.start()
+                reset_answer(questions.nodes[questions.start()])
+            save_checkpoint(st.session_state.worker_id, note[ID_COL])
+
+    if st.session_state.cursor is None:
+        st.info("loading next image")
+        count_confirm_io(note=note)
+        st.rerun()
+
+    with st.container():
+        render_question(questions.nodes[st.session_state.cursor], note[ID_COL])
+
+
+def count_confirm_io(note: pd.Series):
+    """
+    Confirm the item, keeping the I/O it made for the debug sidebar.
+    """
+    with fs.accounting.measure(st.session_state.worker_id) as confirm_io:
+        confirm_label(note)
+    st.session_state.confirm_io = confirm_io
+
+
+previous_rerun_io = st.session_state.get("rerun_io")
+st.session_state.rerun_io = fs.accounting.begin_rerun(st.session_state.get("worker_id"))
+
 st.title("Annotation experiment")
 
 if "worker_id" not in st.session_state:
@@ -420,9 +629,12 @@ st.text_input(
     key="worker_id",
     placeholder=placeholder,
     value=st.session_state.get("worker_id", ""),
-    disabled="worker_id" in st.session_state and len(st.session_state.worker_id),
+    disabled=st.session_state.get("worker_id_locked", False),
     help="Your Prolific ID is used to track your progress and ensure you do not annotate the same item multiple times.",
 )
+# lock the ID from the next rerun on: Streamlit discards what the browser sends
+# for a widget that is disabled in the rerun it arrives in
+st.session_state.worker_id_locked = bool(st.session_state.worker_id)
 if not st.session_state.worker_id:
     st.warning("Please enter your Prolific ID to proceed.")
     st.stop()
@@ -438,12 +650,13 @@ st.pills(
     key="consent",
     help="You must consent to participate in this study to proceed.",
     on_change=lambda: st.session_state.update({"show_consent": False}),
-    disabled="consent" in st.session_state
-    and st.session_state.consent in ["Yes", "No"],
+    disabled=st.session_state.get("consent_locked", False),
 )
+st.session_state.consent_locked = st.session_state.consent in ["Yes", "No"]
 
 if st.session_state.consent == "Yes":
     st.session_state.show_consent = False
+    record_participation()
     st.success(
         "Thank you for consenting to participate in the study. You can now proceed with the annotation task. Please read the instructions carefully before proceeding."
     )
@@ -474,15 +687,29 @@ expander = st.expander("Instructions", expanded=True, icon="❗️")
 expander.markdown(INSTRUCTIONS)
 
 with st.spinner("Loading your annotation session...", show_time=True):
+    time_start = time_before()
     notes = load_notes()
-    question_tree = load_question_tree()
-    st.session_state.question_tree = question_tree
-    if "current_question" not in st.session_state:
-        st.session_state.current_question = question_tree["image"]
+    record_timing("notes", time_start)
+    questions = load_question_tree()
 
-    st.session_state.progress = get_worker_session(
-        st.session_state.worker_id, notes=notes
+    time_start = time_before()
+    try:
+        st.session_state.progress = get_worker_session(
+            st.session_state.worker_id, notes=notes
+        )
+    except scheduling.NoItemsAvailable:
+        no_items_available()
+    load_sessions().scheduler.renew(
+        st.session_state.worker_id,
+        st.session_state.progress.index[
+            st.session_state.progress["done"].isnull()
+        ].tolist(),
     )
+    next_item_id = select_next_item_for_worker_id(st.session_state.progress)
+    record_timing("session", time_start)
+
+if next_item_id is None and not st.session_state.progress["done"].notnull().any():
+    no_items_available()  # every item of a returning worker went to others
 
 with st.sidebar:
     st.header("Progress")
@@ -490,6 +717,25 @@ with st.sidebar:
     total = len(st.session_state.progress)
     st.progress(done / total)
     st.write(f"You have annotated {done} out of {total} items.")
+    if DEBUGGING:
+        st.caption(f"Pending writes: {load_write_queue().pending()}")
+        cache = load_image_cache().stats()
+        st.caption(
+            f"Image cache: {cache['bytes'] / 1024**2:.1f} MB in {cache['images']}"
+            f" images, {cache['hits']} hits, {cache['misses']} misses,"
+            f" {cache['evictions']} evictions"
+        )
+        if previous_rerun_io is not None:
+            st.caption(f"I/O of the last rerun: {previous_rerun_io.summary()}")
+        if "confirm_io" in st.session_state:
+            confirm_io = st.session_state.confirm_io
+            st.caption(f"I/O of the last confirm: {confirm_io.summary()}")
+            over = confirm_io.over_budget(**CONFIRM_IO_BUDGET)
+            if over:
+                st.error(f"The last confirm went over its I/O budget: {over}")
+        worker_io = fs.accounting.workers.get(st.session_state.worker_id)
+        if worker_io is not None:
+            st.caption(f"Your I/O: {worker_io.summary()}")
 
     st.markdown("---")
     st.header("Quick instructions")
@@ -504,10 +750,6 @@ with st.sidebar:
         """
     )
 
-with st.spinner("**Loading images...**", show_time=True):
-    images = load_images(st.session_state.progress["image_name"].tolist())
-    next_item_id = select_next_item_for_worker_id(st.session_state.progress)
-
 if next_item_id is None:
     st.success("You have completed all your annotations. Thank you!")
     st.success(
@@ -520,15 +762,38 @@ if next_item_id is None:
     )
     st.stop()
 
+if st.session_state.get("shown_item") != next_item_id:
+    # nothing answered for another item (e.g. one dropped because its lease
+    # lapsed) may carry over to this one
+    clear_selections()
+    st.session_state.shown_item = next_item_id
 note = notes.loc[next_item_id]
 
 
-image_data = images[note["image_name"]]
+image_preview = None
+if (
+    IMAGE_SERVING == "bytes"
+    and get_image_path(note["image_name"]) not in load_image_cache()
+):
+    # only while the image is being read; a cached one is painted right away
+    image_preview = get_image_preview(note["image_name"])
+if image_preview is not None:
+    # paint the preview now, the full image replaces it once the page is laid out
+    load_image_loader().prefetch([get_image_path(note["image_name"])])
+    image_data = image_preview
+elif IMAGE_SERVING == "bytes":
+    with st.spinner("**Loading image...**", show_time=True):
+        time_start = time_before()
+        image_data = load_image(note["image_name"], st.session_state.progress)
+        record_timing("image", time_start)
+else:
+    image_data = image_url(note["image_name"])  # fetched by the browser
 note_text = anonimize_links(note.note)
 tweet_text = remove_links(note.full_text)
 
 item_number = get_item_number(progress=st.session_state.progress)
 
+render_start = time_before()
 st.header(f"Annotating item {item_number} out of {len(st.session_state.progress)}")
 
 
@@ -541,7 +806,8 @@ with container:
     image_col, text_col = st.columns([3, 2])
     with image_col:
         st.subheader("Tweet image")
-        st.image(image_data)
+        image_slot = st.empty()
+        show_image(image_slot, image_data)
     with text_col:
         st.subheader("Tweet text")
         st.markdown(
@@ -557,242 +823,17 @@ with container:
                 unsafe_allow_html=True,
             )
 
-if "question_counter" not in st.session_state:
-    st.session_state.question_counter = 1
+record_timing("render", render_start)
 
-st.divider()
-claim = True
-# not a claim
-placeholder = st.empty()
-with placeholder.container():
-    st.markdown(
-        f"**Does the tweet and/or image make a claim? (either explicitly or implicitly)**"
-    )
-    st.pills(
-        "Select an answer:",
-        ["Yes", "No"],
-        selection_mode="single",
-        key="has_claim",
-        default=None,
-    )
-    st.text_input(
-        "If not, explain why",
-        key=f"has_claim_text",
-        placeholder="",
-        value=st.session_state.get(f"has_claim_text", ""),
-        disabled=st.session_state["has_claim"] != "No",
-        help="Please explain your choice in a few words.",
-    )
-    st.checkbox(
-        label="Confirm",
-        value=False,
-        key=f"has_claim_confirm",
-        disabled=(not st.session_state["has_claim"])
-        or (
-            st.session_state["has_claim"] == "No"
-            and not st.session_state["has_claim_text"]
-        ),
-    )
-    if not st.session_state["has_claim_confirm"]:
-        st.stop()
-    elif st.session_state["has_claim"] == "No":
-        confirm_label(note=note)
-        st.session_state["has_claim"] = None
-        st.session_state["has_claim_text"] = ""
-        st.session_state["has_claim_confirm"] = False
-        st.rerun()
-    placeholder.empty()
-
-current_question = question_tree["image"]
-# image related stuff
-placeholder = st.empty()
-with placeholder:
-    for i in range(DEEPEST_NODE):
-        question, possible_answers, possible_next_questions = get_question(
-            current_question
-        )
-        mandatory_text_answer: str = is_mandatory_text(current_question)
-        multi_answers = is_multi_answers(current_question)
-        explanation = current_question["explanation"]
+if "resumed" not in st.session_state:
+    # only an earlier connection can have left answers to the item behind
+    resume_item(note[ID_COL], questions)
+    st.session_state.resumed = True
+question_panel(note, questions)
 
-        with st.container():
-            st.subheader(
-                f"{st.session_state.question_counter}) Image related questions"
-            )
-            st.markdown(f"**{question}**")
-            st.pills(
-                explanation,
-                possible_answers,
-                selection_mode="multi" if multi_answers else "single",
-                key=f"image_question_{i}",
-                default=None,
-                args=[f"image_question_{i}", question],
-            )
-
-            if mandatory_text_answer != "None":
-                mandatory_text = True
-                text_input_title = "Explain your choice **(required)**"
-            else:
-                mandatory_text = False
-                text_input_title = "Explain your choice (optional)"
-
-            st.text_input(
-                text_input_title,
-                key=f"image_question_{i}_text",
-                placeholder="",
-                value=st.session_state.get(f"image_question_{i}_text", ""),
-                disabled=not st.session_state[f"image_question_{i}"],
-                help="Please explain your choice in a few words.",
-                args=[f"image_question_{i}_text", "Explain your choice"],
-            )
-            st.checkbox(
-                label="Confirm",
-                value=False,
-                key=f"image_question_{i}_confirm",
-                disabled=disable_confirm(
-                    mandatory_text,
-                    st.session_state[f"image_question_{i}"],
-                    st.session_state[f"image_question_{i}_text"],
-                ),
-                on_change=save_value,
-                args=[question, f"image_question_{i}"],
-            )
-        if not st.session_state[f"image_question_{i}_confirm"]:
-            st.stop()
-        if multi_answers:
-            break
-        answer = st.session_state[f"image_question_{i}"]
-        current_question = possible_next_questions.get(answer)
-        if "label" in current_question:
-            break
-
-placeholder.empty()
-current_question = question_tree["text"]
-
-placeholder = st.empty()
-
-
-with placeholder:
-    for i in range(DEEPEST_NODE):
-        question, possible_answers, possible_next_questions = get_question(
-            current_question
-        )
-        mandatory_text_answer: str = is_mandatory_text(current_question)
-        multi_answers = is_multi_answers(current_question)
-        explanation = current_question["explanation"]
-
-        with st.container():
-            st.subheader(f"{st.session_state.question_counter}) Text related questions")
-            st.markdown(f"**{question}**")
-            st.pills(
-                explanation,
-                possible_answers,
-                selection_mode="multi" if multi_answers else "single",
-                key=f"text_question_{i}",
-                default=None,
-                args=[f"text_question_{i}", question],
-            )
-            if mandatory_text_answer != "None":
-                mandatory_text = True
-                text_input_title = "Explain your choice **(required)**"
-            else:
-                mandatory_text = False
-                text_input_title = "Explain your choice (optional)"
-
-            st.text_input(
-                text_input_title,
-                key=f"text_question_{i}_text",
-                placeholder="",
-                value=st.session_state.get(f"text_question_{i}_text", ""),
-                disabled=not st.session_state[f"text_question_{i}"],
-                help="Please explain your choice in a few words.",
-                args=[f"text_question_{i}_text", "Explain your choice"],
-            )
-            st.checkbox(
-                label="Confirm",
-                value=False,
-                key=f"text_question_{i}_confirm",
-                disabled=disable_confirm(
-                    mandatory_text,
-                    st.session_state[f"text_question_{i}"],
-                    st.session_state[f"text_question_{i}_text"],
-                ),
-                on_change=save_value,
-                args=[question, f"text_question_{i}"],
-            )
-        if not st.session_state[f"text_question_{i}_confirm"]:
-            st.stop()
-        if multi_answers:
-            break
-
-        answer = st.session_state[f"text_question_{i}"]
-        current_question = possible_next_questions.get(answer)
-        if "label" in current_question:
-            break
-
-placeholder.empty()
-current_question = question_tree["text_in_image"]
-placeholder = st.empty()
-
-with placeholder:
-    for i in range(DEEPEST_NODE):
-        question, possible_answers, possible_next_questions = get_question(
-            current_question
-        )
-        mandatory_text_answer: str = is_mandatory_text(current_question)
-        multi_answers = is_multi_answers(current_question)
-        explanation = current_question["explanation"]
-
-        with st.container():
-            st.subheader(f"{st.session_state.question_counter}) Text related questions")
-            st.markdown(f"**{question}**")
-            st.pills(
-                explanation,
-                possible_answers,
-                selection_mode="multi" if multi_answers else "single",
-                key=f"text_in_image_question_{i}",
-                default=None,
-                args=[f"text_in_image_question_{i}", question],
-            )
-            if mandatory_text_answer != "None":
-                mandatory_text = True
-                text_input_title = "Explain your choice **(required)**"
-            else:
-                mandatory_text = False
-                text_input_title = "Explain your choice (optional)"
-
-            st.text_input(
-                text_input_title,
-                key=f"text_in_image_question_{i}_text",
-                placeholder="",
-                value=st.session_state.get(f"text_in_image_question_{i}_text", ""),
-                disabled=not st.session_state[f"text_in_image_question_{i}"],
-                help="Please explain your choice in a few words.",
-                args=[f"text_in_image_question_{i}_text", "Explain your choice"],
-            )
-            st.checkbox(
-                label="Confirm",
-                value=False,
-                key=f"text_in_image_question_{i}_confirm",
-                disabled=disable_confirm(
-                    mandatory_text,
-                    st.session_state[f"text_in_image_question_{i}"],
-                    st.session_state[f"text_in_image_question_{i}_text"],
-                ),
-                on_change=save_value,
-                args=[question, f"text_in_image_question_{i}"],
-            )
-        if not st.session_state[f"text_in_image_question_{i}_confirm"]:
-            st.stop()
-        if multi_answers:
-            break
-
-        answer = st.session_state[f"text_in_image_question_{i}"]
-        current_question = possible_next_questions.get(answer)
-        if "label" in current_question:
-            break
-
-st.info("loading next image")
-st.session_state.question_counter = 1
-confirm_label(note=note)
-st.rerun()
+if image_preview is not None:
+    # swapped in after the page and the questions have been laid out
+    time_start = time_before()
+    full_image = load_image(note["image_name"], st.session_state.progress)
+    record_timing("image", time_start)
+    show_image(image_slot, full_image)
@@ -0,0 +1,209 @@
+"""
+Shared pieces of the benchmarks: a synthetic bucket in a local directory and
+a loader that runs the function definitions of an app without its page.
+"""
+
+import ast
+import io
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import yaml
+from PIL import Image
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+# the apps' functions run without `streamlit run`, which streamlit warns about
+logging.disable(logging.WARNING)
+
+import catalog
+import completion
+import image_manifest
+import storage
+
+BUCKET = storage.BUCKET
+LANGUAGE = "en"
+MAX_LINKS = 60_000
+
+# a small question tree in the format of the flow app's question_tree.yaml
+QUESTION_TREE = {
+    section: {
+        "question": f"Is the {section.replace('_', ' ')} genuine?",
+        "explanation": "Select an answer",
+        "mandatory_text": False,
+        "answers": {
+            "Yes": {"label": "genuine"},
+            "No": {
+                "question": "In what way is it not genuine?",
+                "explanation": "Select all that apply",
+                "mandatory_text": "required-Other",
+                "multiple_answers": True,
+                "answers": {
+                    "Edited": {"label": "edited"},
+                    "Generated": {"label": "generated"},
+                    "Other": {"label": "other"},
+                },
+            },
+        },
+    }
+    for section in ["image", "text", "text_in_image"]
+}
+
+
+def jpeg(width: int = 480, height: int = 600, seed: int = 0) -> bytes:
+    pixels = np.random.default_rng(seed).integers(0, 255, (height // 8, width // 8, 3))
+    img = Image.fromarray(pixels.astype("uint8")).resize((width, height))
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _link_images(folder: str, names: list, data: bytes):
+    # every image is a hard link to one of a few files, so a million of them
+    # are cheap; file systems cap the links per file
+    os.makedirs(folder, exist_ok=True)
+    for start in range(0, len(names), MAX_LINKS):
+        source = os.path.join(folder, f".source{start}.jpeg")
+        with open(source, "wb") as f:
+            f.write(data)
+        for name in names[start : start + MAX_LINKS]:
+            path = os.path.join(folder, name)
+            if not os.path.exists(path):
+                os.link(source, path)
+
+
+def note_ids(notes: int) -> np.ndarray:
+    return np.arange(10**15, 10**15 + notes, dtype="int64")
+
+
+def make_bucket(
+    root: str,
+    notes: int,
+    qualification: int = 5,
+    build_catalog: bool = True,
+    emotions: bool = False,
+) -> dict:
+    """
+    Lay out a local bucket for the visual evidence apps under `root`: `notes`
+    notes with one image each, `qualification` qualification notes, the
+    question tree and the image manifest; with `emotions` also the notes and
+    images of the emotions app. Returns the paths.
+    """
+    fs = storage.LocalStorage(root)
+    data = jpeg()
+    ids = note_ids(notes)
+    names = [f"{i}.jpeg" for i in ids]
+    notes_csv = f"{BUCKET}/data/multimodal_tweets_balanced.csv"
+    with fs.open(notes_csv, "w") as f:
+        pd.DataFrame(
+            {
+                "tweet_id": ids,
+                "image_name": names,
+                "full_text": "A tweet about something https://t.co/abc",
+                "note": "Additional context from a note https://example.com",
+                "language_present": LANGUAGE,
+            }
+        ).to_csv(f, index=False)
+    if build_catalog:
+        catalog.convert(
+            fs, notes_csv, f"{BUCKET}/data/multimodal_tweets_balanced", "tweet_id"
+        )
+
+    qualification_ids = np.arange(qualification, dtype="int64") + 1
+    qualification_names = [f"q{i}.jpeg" for i in qualification_ids]
+    with fs.open(f"{BUCKET}/data/{LANGUAGE}_qualification_data.csv", "w") as f:
+        pd.DataFrame(
+            {
+                "tweet_id": qualification_ids,
+                "image_name": qualification_names,
+                "full_text": "A qualification tweet",
+                "note": "A qualification note",
+            }
+        ).to_csv(f, index=False)
+
+    with fs.open(f"{BUCKET}/static/question_tree.yaml", "w") as f:
+        yaml.safe_dump(QUESTION_TREE, f, sort_keys=False)
+
+    image_folder = f"{BUCKET}/static/resized_images/"
+    qualification_folder = f"{BUCKET}/static/qualification_images/"
+    _link_images(fs._local(image_folder), names, data)
+    _link_images(fs._local(qualification_folder), qualification_names, data)
+    folders = [image_folder] * notes + [qualification_folder] * qualification
+    names = names + qualification_names
+
+    if emotions:
+        emotion_names = [f"{i}.png" for i in ids]
+        with fs.open(f"{BUCKET}/data/tweets_with_images.csv", "w") as f:
+            pd.DataFrame(
+                {
+                    "tweetId": ids,
+                    "image_name": emotion_names,
+                    "text": "A tweet about something",
+                }
+            ).to_csv(f, index=False)
+        _link_images(fs._local(image_folder), emotion_names, data)
+        folders = folders + [image_folder] * notes
+        names = names + emotion_names
+
+    row = image_manifest.describe("", "", data)
+    manifest = pd.DataFrame({"name": names, "folder": folders})
+    for column in ["size", "width", "height", "sha256", "preview"]:
+        manifest[column] = row[column]
+    image_manifest.write_manifest(fs, manifest)
+
+    return {"notes": notes_csv, "images": image_folder}
+
+
+def write_done_log(root: str, notes: int, done: int, task: str) -> str:
+    """
+    Replace the done log of `task` with `done` completion records of random
+    notes, and drop its unfolded shards.
+    """
+    fs = storage.LocalStorage(root)
+    done_file = f"{BUCKET}/data/done_{task}.txt"
+    items = np.random.default_rng(done).choice(note_ids(notes), size=done)
+    with fs.open(done_file, "w") as f:
+        f.writelines(f"{item},bench{n}\n" for n, item in enumerate(items))
+    shards = fs.glob(f"{completion.shard_folder(done_file)}*")
+    if shards:
+        fs.rm(shards)
+    return done_file
+
+
+def load_app(path: str, fs, overrides: dict = None) -> dict:
+    """
+    Run the imports, constants and function definitions of an app script,
+    stopping before the page itself (the first `st.title`), and return its
+    namespace with `fs` and `overrides` swapped in.
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    body = []
+    for node in tree.body:
+        source = ast.unparse(node)
+        if source.startswith("st.title("):
+            break
+        if source.startswith("st.set_page_config("):
+            continue
+        body.append(node)
+    namespace = {"__name__": "app", "__file__": path}
+    code = compile(ast.Module(body=body, type_ignores=[]), path, "exec")
+    exec(code, namespace)
+    namespace["fs"] = fs
+    namespace.update(overrides or {})
+    return namespace
+
+
+def percentiles(samples: list) -> dict:
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000
+    return {"p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "n": len(samples)}
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
@@ -0,0 +1,82 @@
+"""
+Serial vs. concurrent image fetching.
+
+Reads a session's worth of images from a local storage backend that adds a
+fixed delay to every read, standing in for a GCS round trip, once one at a
+time like the old `load_images` and once through `ImageLoader.fetch_all`.
+
+    python benchmarks/image_fetch.py --images 25 --latency 0.08
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import image_loader
+import storage
+
+FOLDER = "annotation-experiment/static/resized_images/"
+
+
+class SlowStorage:
+    """
+    Wraps a backend, sleeping `latency` seconds before every open.
+    """
+
+    def __init__(self, fs, latency: float):
+        self.fs = fs
+        self.latency = latency
+
+    def open(self, path: str, mode: str = "r"):
+        time.sleep(self.latency)
+        return self.fs.open(path, mode)
+
+    def __getattr__(self, name):
+        return getattr(self.fs, name)
+
+
+def make_images(fs, n: int, size: int) -> list:
+    paths = [f"{FOLDER}{i:05d}.jpeg" for i in range(n)]
+    for path in paths:
+        with fs.open(path, "wb") as f:
+            f.write(os.urandom(size))
+    return paths
+
+
+def fetch_serial(fs, paths: list) -> dict:
+    return {path: fs.open(path, "rb").read() for path in paths}
+
+
+def fetch_concurrent(fs, paths: list, max_workers: int) -> dict:
+    return image_loader.ImageLoader(fs, max_workers=max_workers).fetch_all(paths)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", type=int, default=25)
+    parser.add_argument("--size", type=int, default=100_000, help="bytes per image")
+    parser.add_argument("--latency", type=float, default=0.08, help="seconds per read")
+    parser.add_argument("--workers", type=int, default=image_loader.MAX_WORKERS)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        fs = SlowStorage(storage.LocalStorage(root), args.latency)
+        paths = make_images(fs, args.images, args.size)
+
+        start = time.perf_counter()
+        serial = fetch_serial(fs, paths)
+        serial_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        concurrent = fetch_concurrent(fs, paths, args.workers)
+        concurrent_time = time.perf_counter() - start
+
+    assert concurrent == serial
+    print(f"{args.images} images, {args.latency * 1000:.0f} ms per read")
+    print(f"serial:     {serial_time:.3f} s")
+    print(f"concurrent: {concurrent_time:.3f} s ({args.workers} workers)")
+    print(f"speedup:    {serial_time / concurrent_time:.1f}x")
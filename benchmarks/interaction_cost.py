@@ -0,0 +1,280 @@
+"""
+Websocket bytes and server CPU per interaction.
+
+Runs an app with `streamlit run` against a synthetic bucket (see harness.py)
+and talks to it over the websocket the way the browser does, answering the
+ID and consent steps until the first item is on the page. It then repeats a
+single interaction with the question panel of the flow app (picking and
+clearing the answer to the first question), once as the browser sends it, as
+a rerun of the panel's fragment only, and once as a rerun of the whole
+script, and reports the bytes the server sent and the CPU time it used per
+interaction for both:
+
+    python benchmarks/interaction_cost.py --interactions 50
+
+The websocket client is a minimal one on the standard library, speaking just
+the binary frames Streamlit uses.
+"""
+
+import argparse
+import base64
+import json
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import harness  # puts the repo on the path
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+WIDGET_TYPES = ("text_input", "checkbox", "button_group", "radio", "button")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+class WebSocket:
+    def __init__(self, port: int):
+        self.sock = socket.create_connection(("localhost", port))
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall(
+            (
+                "GET /_stcore/stream HTTP/1.1\r\n"
+                f"Host: localhost:{port}\r\n"
+                "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n"
+                "Sec-WebSocket-Protocol: streamlit\r\n\r\n"
+            ).encode()
+        )
+        response = b""
+        while b"\r\n\r\n" not in response:
+            response += self.sock.recv(1)
+        if b" 101 " not in response.split(b"\r\n")[0]:
+            raise ConnectionError(response.decode(errors="replace"))
+
+    def _recv_exactly(self, n: int) -> bytes:
+        data = b""
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("websocket closed")
+            data += chunk
+        return data
+
+    def send(self, payload: bytes, opcode: int = 2):
+        header = bytes([0x80 | opcode])
+        n = len(payload)
+        if n < 126:
+            header += bytes([0x80 | n])
+        elif n < 2**16:
+            header += bytes([0x80 | 126]) + struct.pack("!H", n)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack("!Q", n)
+        mask = os.urandom(4)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.sock.sendall(header + mask + masked)
+
+    def recv(self) -> bytes:
+        message = b""
+        while True:
+            first, second = self._recv_exactly(2)
+            n = second & 0x7F
+            if n == 126:
+                n = struct.unpack("!H", self._recv_exactly(2))[0]
+            elif n == 127:
+                n = struct.unpack("!Q", self._recv_exactly(8))[0]
+            payload = self._recv_exactly(n)
+            opcode = first & 0x0F
+            if opcode == 9:  # ping
+                self.send(payload, opcode=10)
+                continue
+            if opcode == 8:
+                raise ConnectionError("websocket closed")
+            message += payload
+            if first & 0x80:
+                return message
+
+    def close(self):
+        self.sock.close()
+
+
+class Browser:
+    """
+    Keeps the widget states of one session and sends them with every rerun,
+    like the frontend does.
+    """
+
+    def __init__(self, port: int):
+        self.ws = WebSocket(port)
+        self.widgets = {}  # key -> (widget id, fragment id)
+        self.states = {}  # widget id -> WidgetState
+
+    def rerun(self, fragment_id: str = "") -> int:
+        """
+        Request a rerun and wait for it to finish. Returns the bytes received.
+        """
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.page_script_hash = ""
+        msg.rerun_script.fragment_id = fragment_id
+        msg.rerun_script.widget_states.widgets.extend(self.states.values())
+        self.ws.send(msg.SerializeToString())
+        received = 0
+        while True:
+            data = self.ws.recv()
+            received += len(data)
+            forward = ForwardMsg()
+            forward.ParseFromString(data)
+            kind = forward.WhichOneof("type")
+            if kind == "new_session":
+                self._begin(forward.new_session.fragment_ids_this_run)
+            elif kind == "delta":
+                self._register(forward.delta)
+            elif kind == "script_finished":
+                if forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    return received
+
+    def _begin(self, fragment_ids):
+        """
+        Forget the widgets the run that starts draws again: all of them, or
+        those of the fragments it reruns.
+        """
+        self.widgets = {
+            key: (widget_id, fragment_id)
+            for key, (widget_id, fragment_id) in self.widgets.items()
+            if fragment_ids and fragment_id not in fragment_ids
+        }
+
+    def _register(self, delta):
+        if delta.WhichOneof("type") != "new_element":
+            return
+        element = delta.new_element
+        kind = element.WhichOneof("type")
+        if kind not in WIDGET_TYPES:
+            return
+        widget_id = getattr(element, kind).id
+        key = widget_id.rsplit("-", 1)[-1]
+        self.widgets[key] = (widget_id, delta.fragment_id)
+
+    def set(self, key: str, field: str, value):
+        widget_id, _ = self.widgets[key]
+        state = WidgetState(id=widget_id)
+        if field == "string_array_value":
+            state.string_array_value.data.extend(value)
+        else:
+            setattr(state, field, value)
+        self.states[widget_id] = state
+
+    def fragment_of(self, key: str) -> str:
+        return self.widgets[key][1]
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def start_server(app: str, root: str, port: int) -> subprocess.Popen:
+    env = dict(os.environ, ANNOTATION_STORAGE="local", ANNOTATION_STORAGE_PATH=root)
+    # the server runs in the bucket directory, with the repo's configuration
+    shutil.copytree(
+        os.path.join(harness.ROOT, ".streamlit"), os.path.join(root, ".streamlit")
+    )
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "streamlit",
+            "run",
+            app,
+            "--server.headless=true",
+            f"--server.port={port}",
+            "--server.enableXsrfProtection=false",
+            "--server.fileWatcherType=none",
+            "--browser.gatherUsageStats=false",
+        ],
+        cwd=root,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    for _ in range(300):
+        try:
+            urllib.request.urlopen(f"http://localhost:{port}/_stcore/health")
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("the server didn't start")
+
+
+def open_first_item(browser: Browser, worker_id: str):
+    browser.rerun()
+    browser.set("worker_id", "string_value", worker_id)
+    browser.rerun()
+    browser.set("consent", "string_array_value", ["Yes"])
+    browser.rerun()
+    if "has_claim" not in browser.widgets:
+        raise RuntimeError("the question panel didn't show up")
+
+
+def measure(browser: Browser, pid: int, interactions: int, fragment: bool) -> dict:
+    fragment_id = browser.fragment_of("has_claim") if fragment else ""
+    sent = []
+    cpu = []
+    for i in range(interactions):
+        browser.set("has_claim", "string_array_value", ["Yes"] if i % 2 else [])
+        start = cpu_seconds(pid)
+        sent.append(browser.rerun(fragment_id))
+        cpu.append(cpu_seconds(pid) - start)
+    return {
+        "bytes": sum(sent) / interactions,
+        "cpu_ms": sum(cpu) / interactions * 1000,
+    }
+
+
+def run(args) -> dict:
+    app = os.path.join(harness.ROOT, args.app)
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        harness.make_bucket(root, args.notes)
+        server = start_server(app, root, args.port)
+        try:
+            browser = Browser(args.port)
+            open_first_item(browser, "interaction-cost")
+            if not browser.fragment_of("has_claim"):
+                print("The question panel isn't a fragment, measuring full reruns")
+            for name, fragment in [("fragment", True), ("full", False)]:
+                results[name] = measure(
+                    browser, server.pid, args.interactions, fragment
+                )
+                print(
+                    f"{name:>9} rerun: {results[name]['bytes']:9.0f} B sent,"
+                    f" {results[name]['cpu_ms']:7.1f} ms server CPU per interaction"
+                )
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--app", default="app_visual_evidence_flow.py")
+    parser.add_argument("--notes", type=int, default=1000)
+    parser.add_argument("--interactions", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--output", default="benchmarks/results/interaction_cost.json")
+    args = parser.parse_args()
+
+    results = run(args)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"app": args.app, "interactions": args.interactions} | results, f)
+    print(f"Results written to {args.output}")
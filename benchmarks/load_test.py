@@ -0,0 +1,364 @@
+"""
+Concurrent participant load test.
+
+Runs an app with `streamlit run` against a synthetic bucket (see harness.py)
+and connects N simulated participants to that one server at once, each over
+a websocket of its own like a browser tab (the client of
+interaction_cost.py). Every participant enters a Prolific ID, consents and
+confirms items with random answers (walking the question tree of the flow
+app). For every level of concurrency it reports the latency of the reruns
+as the participants see them, the time from consenting to the first image,
+the CPU time and peak memory of the server and how many participants found
+no items left to annotate:
+
+    python benchmarks/load_test.py --app app_visual_evidence_flow.py \\
+        --participants 1 5 10 20 --items 3
+
+The participants share everything a real deployment shares: the server's
+caches, its leases and write queue, and its CPU. Every level starts a fresh
+server on a fresh bucket, so its peak memory is that of the level alone.
+The participants are threads of this process; they only wait on their
+sockets, so they don't compete with the server for much CPU.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import traceback
+
+import harness  # puts the repo on the path
+from interaction_cost import Browser, cpu_seconds, start_server
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+APPS = ["app.py", "app_visual_evidence.py", "app_visual_evidence_flow.py"]
+MAX_STEPS = 100  # interactions per item before a participant counts as stuck
+NO_ITEMS = "nothing left for you to annotate"  # the apps' no_items_available
+PROGRESS = re.compile(r"You have annotated (\d+) out of (\d+) items")
+
+
+class Page(Browser):
+    """
+    A browser that also keeps what the last rerun put on the page: the
+    widgets with their elements, whether there is an image, the text of the
+    alerts and the progress in the sidebar.
+    """
+
+    def __init__(self, port: int, timeout: float):
+        super().__init__(port)
+        self.ws.sock.settimeout(timeout)
+        self.elements = {}  # key -> widget element, buttons aside
+        self.images = 0
+        self.alerts = []
+        self.progress = None  # (done, total)
+
+    def rerun(self, fragment_id: str = "") -> int:
+        received = super().rerun(fragment_id)
+        # the frontend drops the state of widgets that are no longer shown
+        shown = {widget_id for widget_id, _ in self.widgets.values()}
+        self.states = {i: s for i, s in self.states.items() if i in shown}
+        return received
+
+    def _begin(self, fragment_ids):
+        super()._begin(fragment_ids)
+        self.elements = {k: v for k, v in self.elements.items() if k in self.widgets}
+        if not fragment_ids:
+            self.images, self.alerts = 0, []
+
+    def _register(self, delta):
+        super()._register(delta)
+        if delta.WhichOneof("type") != "new_element":
+            return
+        element = delta.new_element
+        kind = element.WhichOneof("type")
+        if kind == "imgs":
+            self.images += 1
+        elif kind == "alert":
+            self.alerts.append(element.alert.body)
+        elif kind == "markdown":
+            match = PROGRESS.search(element.markdown.body)
+            if match:
+                self.progress = (int(match[1]), int(match[2]))
+        elif kind in ("text_input", "checkbox", "button_group", "radio"):
+            proto = getattr(element, kind)
+            self.elements[proto.id.rsplit("-", 1)[-1]] = proto
+            # like the frontend, send every widget's value, and take the
+            # value the script gave it over the one sent
+            if proto.set_value or proto.id not in self.states:
+                self._take_value(kind, proto)
+
+    def _take_value(self, kind: str, proto):
+        state = WidgetState(id=proto.id)
+        if kind == "button_group":
+            if proto.set_value:
+                values = proto.raw_values
+            else:
+                values = [proto.options[i].content for i in proto.default]
+            state.string_array_value.data.extend(values)
+        elif kind == "checkbox":
+            state.bool_value = proto.value if proto.set_value else proto.default
+        elif proto.set_value:
+            state.string_value = proto.raw_value if kind == "radio" else proto.value
+        elif proto.HasField("default"):
+            default = proto.default
+            state.string_value = proto.options[default] if kind == "radio" else default
+        else:
+            self.states.pop(proto.id, None)
+            return
+        self.states[proto.id] = state
+
+    def value(self, key: str):
+        state = self.states.get(self.elements[key].id)
+        if state is None:
+            return None
+        if state.HasField("string_array_value"):
+            return list(state.string_array_value.data)
+        return getattr(state, state.WhichOneof("value"))
+
+    def forget(self, keep: tuple):
+        """
+        Drop the values of every widget but those in `keep`, so they aren't
+        sent again.
+        """
+        kept = {self.widgets[key][0] for key in keep if key in self.widgets}
+        self.states = {i: s for i, s in self.states.items() if i in kept}
+
+    def click(self, key: str) -> int:
+        self.set(key, "trigger_value", True)
+        try:
+            return self.rerun()
+        finally:
+            # a click is only sent with the rerun it triggers
+            self.states.pop(self.widgets[key][0], None)
+
+
+class Participant:
+    def __init__(self, app: str, port: int, worker_id: str, seed: int, timeout):
+        self.app = app
+        self.port = port
+        self.timeout = timeout
+        self.worker_id = worker_id
+        self.rng = random.Random(seed)
+        self.page = None
+        self.reruns = []  # seconds
+        self.first_image = None  # seconds from consenting to the first image
+        self.no_items = False  # every item had been annotated enough already
+        self.error = None
+
+    def run(self, interact=None, fragment_id: str = ""):
+        start = time.perf_counter()
+        if interact is None:
+            self.page.rerun(fragment_id)
+        else:
+            interact()
+        self.reruns.append(time.perf_counter() - start)
+
+    def done(self) -> int:
+        return self.page.progress[0] if self.page.progress else 0
+
+    def finished(self) -> bool:
+        return self.page.progress is not None and self.done() == self.page.progress[1]
+
+    def start(self):
+        self.page = Page(self.port, self.timeout)
+        self.run()
+        self.page.set("worker_id", "string_value", self.worker_id)
+        self.run()
+        consent = self.page.elements["consent"]
+        if consent.DESCRIPTOR.name == "ButtonGroup":
+            self.page.set("consent", "string_array_value", ["Yes"])
+        else:
+            self.page.set("consent", "string_value", "Yes")
+        start = time.perf_counter()
+        self.run()
+        for _ in range(MAX_STEPS):
+            if self.page.images:
+                break
+            if any(NO_ITEMS in alert for alert in self.page.alerts):
+                self.no_items = True
+                return
+            self.run()
+        else:
+            raise RuntimeError(f"{self.worker_id} never got an image")
+        self.first_image = time.perf_counter() - start
+
+    def annotate(self):
+        """
+        Answer the current item and confirm it.
+        """
+        done = self.done()
+        page = self.page
+        if self.app == "app.py":
+            boxes = [
+                key
+                for key, proto in page.elements.items()
+                if proto.DESCRIPTOR.name == "Checkbox" and not proto.disabled
+            ]
+            page.set(self.rng.choice(boxes), "bool_value", True)
+            self.run()
+            self.run(lambda: page.click("confirm_button"))
+        elif self.app == "app_visual_evidence.py":
+            for key, proto in page.elements.items():
+                if proto.DESCRIPTOR.name == "Radio" and key != "consent":
+                    page.set(key, "string_value", self.rng.choice(proto.options))
+            self.run(lambda: page.click("confirm_button"))
+        else:
+            # the app resets the answers when it moves on to the next item,
+            # but it reruns right away, and a reset followed by st.rerun()
+            # never reaches the browser; forget them here instead
+            page.forget(("worker_id", "consent"))
+            for _ in range(MAX_STEPS):
+                if self.done() > done:
+                    break
+                self.step()
+        if self.done() <= done:
+            raise RuntimeError(f"{self.worker_id} is stuck on an item")
+
+    def step(self):
+        """
+        Make the next interaction of the flow app's question tree: pick an
+        answer, explain it, or confirm it. Each is a rerun of the fragment the
+        widget is in, as the browser sends it.
+        """
+        page = self.page
+        for key, proto in list(page.elements.items()):
+            kind = proto.DESCRIPTOR.name
+            if proto.disabled or key == "consent" or page.value(key):
+                continue
+            if kind == "ButtonGroup":
+                answer = self.rng.choice(proto.options).content
+                page.set(key, "string_array_value", [answer])
+            elif kind == "TextInput" and key.endswith("_text"):
+                page.set(key, "string_value", "An explanation")
+            elif kind == "Checkbox" and key.endswith("_confirm"):
+                page.set(key, "bool_value", True)
+            else:
+                continue
+            return self.run(fragment_id=page.fragment_of(key))
+        raise RuntimeError(f"{self.worker_id} has nothing to answer")
+
+    def participate(self, items: int):
+        try:
+            self.start()
+            for _ in range(items):
+                if self.no_items or self.finished():
+                    break
+                self.annotate()
+        except Exception:
+            self.error = traceback.format_exc(limit=3)
+        finally:
+            if self.page is not None:
+                self.page.ws.close()
+
+
+def peak_rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError(f"no VmHWM for {pid}")
+
+
+def load_level(
+    app: str, port: int, participants: int, items: int, timeout: float
+) -> dict:
+    group = [
+        Participant(app, port, f"load-{participants}-{n}", n, timeout)
+        for n in range(participants)
+    ]
+    threads = [
+        threading.Thread(target=participant.participate, args=[items])
+        for participant in group
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    reruns = [t for participant in group for t in participant.reruns]
+    first_images = [p.first_image for p in group if p.first_image is not None]
+    errors = [participant.error for participant in group if participant.error]
+    return {
+        "participants": participants,
+        "items": sum(participant.done() for participant in group if participant.page),
+        "wall_s": wall,
+        "reruns": harness.percentiles(reruns) if reruns else None,
+        "first_image": harness.percentiles(first_images) if first_images else None,
+        "no_items": sum(participant.no_items for participant in group),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+    }
+
+
+def run_level(
+    app: str, notes: int, port: int, participants: int, items: int, timeout: float
+) -> dict:
+    """
+    Run one level against a server of its own, on a fresh bucket, so every
+    level starts with all items open and the server's peak memory is its own.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        harness.make_bucket(root, notes, emotions=True)
+        server = start_server(app, root, port)
+        try:
+            cpu = cpu_seconds(server.pid)
+            level = load_level(
+                os.path.basename(app), port, participants, items, timeout
+            )
+            level["server_cpu_s"] = cpu_seconds(server.pid) - cpu
+            level["server_peak_rss_mb"] = peak_rss_mb(server.pid)
+        finally:
+            server.terminate()
+            server.wait()
+    return level
+
+
+def report(level: dict):
+    def ms(stats, key):
+        return f"{stats[key]:8.1f}" if stats else "       -"
+
+    print(
+        f"participants={level['participants']:<4} items={level['items']:<5}"
+        f" rerun p50/p95/p99={ms(level['reruns'], 'p50_ms')}"
+        f"{ms(level['reruns'], 'p95_ms')}{ms(level['reruns'], 'p99_ms')} ms"
+        f" first image p50/p95={ms(level['first_image'], 'p50_ms')}"
+        f"{ms(level['first_image'], 'p95_ms')} ms"
+        f" server cpu={level['server_cpu_s']:6.1f} s"
+        f" peak rss={level['server_peak_rss_mb']:7.1f} MB"
+        f" no items={level['no_items']} errors={level['errors']}"
+    )
+    if level["first_error"]:
+        print(level["first_error"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--app", default="app_visual_evidence_flow.py", choices=APPS)
+    parser.add_argument("--participants", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--items", type=int, default=3, help="items per participant")
+    parser.add_argument("--notes", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds per rerun")
+    parser.add_argument("--port", type=int, default=8598)
+    parser.add_argument("--output", default="benchmarks/results/load_test.json")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    app = os.path.join(harness.ROOT, args.app)
+
+    levels = []
+    for participants in args.participants:
+        level = run_level(
+            app, args.notes, args.port, participants, args.items, args.timeout
+        )
+        report(level)
+        levels.append(level)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"app": args.app, "notes": args.notes, "levels": levels}, f, indent=1)
+    print(f"Results written to {output}")
@@ -0,0 +1,193 @@
+"""
+Latency and bytes moved of the annotation I/O paths.
+
+Runs the real `load_notes`, `load_sessions`, `get_worker_session`,
+`load_image` and `confirm_label` of one of the visual evidence apps (APPS)
+against a synthetic bucket in a local directory (see harness.py), for every
+combination of catalog size and done-log size, and reports p50/p95/p99
+latency and the round trips and bytes read and written per call (see
+io_accounting.py):
+
+    python benchmarks/storage_paths.py --notes 1000 100000 1000000 \\
+        --done 0 100000 --output benchmarks/results/storage_paths.json
+
+`load_notes` and `load_sessions` (which reads the completion counts) are
+measured cold, their caches cleared before every call, and `load_image`, the
+image of the first item of a new session, with an empty image cache. Writes that go through
+the write-behind queue are counted when they are made. Every call of an
+operation with an entry in BUDGETS is checked against it, and the run fails
+with IOBudgetExceeded if one goes over.
+"""
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import uuid
+
+import harness  # puts the repo on the path
+import streamlit as st
+
+import io_accounting
+import storage
+
+APPS = ["app_visual_evidence.py", "app_visual_evidence_flow.py"]
+# I/O allowed per call, see io_accounting.IOCounter.check
+BUDGETS = {"confirm_label": {"writes": 2, "full_reads": 0}}
+
+
+def start_session(app: dict, notes):
+    worker_id = f"bench-{uuid.uuid4().hex[:12]}"
+    st.session_state.worker_id = worker_id
+    return worker_id, app["get_worker_session"](worker_id, notes)
+
+
+def bench(
+    app: dict, fs: io_accounting.AccountingStorage, repeat: int, cold_repeat: int
+):
+    queue = app["load_write_queue"]()
+    notes = app["load_notes"]()
+    app["load_sessions"]()
+    if "load_question_tree" in app:
+        app["load_question_tree"]()  # loaded by the page before any confirm
+
+    def measure(name, fn, setup=lambda: None, repeat=repeat):
+        samples = []
+        moved = dict.fromkeys(io_accounting.FIELDS, 0)
+        for _ in range(repeat):
+            args = setup()
+            queue.flush(60)
+            fs.accounting.reset()
+            with fs.accounting.budget(**BUDGETS.get(name, {})):
+                _, elapsed = harness.timed(fn, *(args or ()))
+            for field, n in fs.accounting.reset().counts.items():
+                moved[field] += n
+            samples.append(elapsed)
+        result = harness.percentiles(samples)
+        result.update({field: n / repeat for field, n in moved.items()})
+        return result
+
+    def cold(*loaders):
+        for loader in loaders:
+            app[loader].clear()
+
+    def first_item(progress):
+        item = app["select_next_item_for_worker_id"](progress)
+        return notes.loc[item]
+
+    def new_image():
+        cold("load_image_cache", "load_image_loader")
+        _, progress = start_session(app, notes)
+        st.session_state.progress = progress
+        return first_item(progress)["image_name"], progress
+
+    def labelled_item():
+        _, progress = start_session(app, notes)
+        st.session_state.progress = progress
+        if "LABELS" in app:
+            label = app["LABELS"][0]
+            st.session_state[label] = app["QUESTION_OPTIONS"][label][0]
+        else:  # the flow app keeps the answers given along the question tree
+            st.session_state.labels = [("A question", "An answer", "")]
+        return (first_item(progress),)
+
+    return {
+        "load_notes": measure(
+            "load_notes",
+            app["load_notes"],
+            lambda: cold(
+                "load_notes", "load_image_manifest", "load_qualification_notes"
+            ),
+            repeat=cold_repeat,
+        ),
+        "load_sessions": measure(
+            "load_sessions",
+            app["load_sessions"],
+            lambda: cold("load_sessions"),
+            repeat=cold_repeat,
+        ),
+        "get_worker_session": measure(
+            "get_worker_session",
+            lambda: start_session(app, notes),
+            lambda: st.session_state.clear(),
+        ),
+        "load_image": measure("load_image", app["load_image"], new_image),
+        "confirm_label": measure("confirm_label", app["confirm_label"], labelled_item),
+    }
+
+
+def run(args) -> list:
+    results = []
+    for notes in args.notes:
+        with tempfile.TemporaryDirectory() as root:
+            harness.make_bucket(root, notes, build_catalog=not args.csv)
+            os.environ.update(ANNOTATION_STORAGE="local", ANNOTATION_STORAGE_PATH=root)
+            for done in args.done:
+                st.cache_resource.clear()
+                fs = io_accounting.AccountingStorage(storage.LocalStorage(root))
+                app = harness.load_app(
+                    os.path.join(harness.ROOT, args.app),
+                    fs,
+                    {
+                        "DEBUGGING": False,
+                        "STATE_BACKEND": args.state,
+                        "SPOOL_FOLDER": os.path.join(root, "pending_writes"),
+                        "STATE_DB": os.path.join(root, f"state_{done}.sqlite"),
+                    },
+                )
+                harness.write_done_log(root, notes, done, app["TASK_NAME"])
+                try:
+                    operations = bench(app, fs, args.repeat, args.cold_repeat)
+                finally:
+                    app["load_write_queue"]().close()
+                for operation, result in operations.items():
+                    results.append(
+                        {"operation": operation, "notes": notes, "done": done} | result
+                    )
+                    print(
+                        f"{operation:>20} notes={notes:<8} done={done:<8}"
+                        f" p50={result['p50_ms']:9.2f} ms"
+                        f" p95={result['p95_ms']:9.2f} ms"
+                        f" p99={result['p99_ms']:9.2f} ms"
+                        f" reads={result['reads']:6.1f}"
+                        f" writes={result['writes']:5.1f}"
+                        f" read={result['bytes_read']:12.0f} B"
+                        f" written={result['bytes_written']:8.0f} B"
+                    )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--app", default=APPS[0], choices=APPS)
+    parser.add_argument(
+        "--notes", type=int, nargs="+", default=[1000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--done", type=int, nargs="+", default=[0, 10_000, 100_000])
+    parser.add_argument("--state", default="bucket", choices=["bucket", "sqlite"])
+    parser.add_argument("--csv", action="store_true", help="don't build the catalog")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--cold-repeat", type=int, default=5, help="repeats of the cold loads"
+    )
+    parser.add_argument("--output", default="benchmarks/results/storage_paths.json")
+    args = parser.parse_args()
+
+    results = run(args)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "app": args.app,
+                "state": args.state,
+                "catalog": not args.csv,
+                "repeat": args.repeat,
+                "cold_repeat": args.cold_repeat,
+                "python": platform.python_version(),
+                "results": results,
+            },
+            f,
+            indent=1,
+        )
+    print(f"Results written to {args.output}")
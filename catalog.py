@@ -0,0 +1,182 @@
+"""
+Columnar notes catalog.
+
+`convert` turns the notes CSV into a Parquet dataset partitioned by language,
+one file per language:
+
+    <catalog>/language_present=en/part-00000.parquet
+
+Notes without a language go to the partition MISSING_LANGUAGE. Every column
+is stored as a string except the ID, an int64, so a chunk whose column is all
+empty is written with the same schema as the others.
+
+`read_notes` only opens the partition of the language it needs, only reads
+the columns it asks for, and streams the rows in batches instead of parsing
+the whole CSV in memory. When a catalog hasn't been built yet, `read_notes`
+streams the CSV in chunks instead.
+
+Build a catalog with:
+
+    python catalog.py annotation-experiment/data/multimodal_tweets_balanced.csv \\
+        annotation-experiment/data/multimodal_tweets_balanced
+
+It uses the storage backend from the environment, see storage.py.
+"""
+
+import argparse
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import storage
+
+PARTITION_COLUMN = "language_present"
+MISSING_LANGUAGE = "__HIVE_DEFAULT_PARTITION__"  # Hive's name for a null value
+CHUNKSIZE = 100_000  # rows per CSV chunk / Parquet row group
+BATCH_SIZE = 65_536  # rows per batch when reading the catalog
+
+
+def partition_path(catalog_path: str, language: str) -> str:
+    return f"{catalog_path}/{PARTITION_COLUMN}={language}/part-00000.parquet"
+
+
+def catalog_schema(columns: list, id_col: str) -> pa.Schema:
+    return pa.schema(
+        [
+            (column, pa.int64() if column == id_col else pa.string())
+            for column in columns
+            if column != PARTITION_COLUMN
+        ]
+    )
+
+
+def convert(
+    fs,
+    csv_path: str,
+    catalog_path: str,
+    id_col: str = "tweet_id",
+    chunksize: int = CHUNKSIZE,
+) -> dict:
+    """
+    Write the CSV at `csv_path` as a language-partitioned Parquet catalog.
+    Returns the number of rows written per language.
+    """
+    files = {}
+    writers = {}
+    rows = {}
+    try:
+        with fs.open(csv_path, "r") as f:
+            for chunk in pd.read_csv(f, dtype=str, chunksize=chunksize):
+                chunk[id_col] = chunk[id_col].astype("int64")
+                schema = catalog_schema(list(chunk.columns), id_col)
+                for language, part in chunk.groupby(PARTITION_COLUMN, dropna=False):
+                    if pd.isna(language):
+                        language = MISSING_LANGUAGE
+                    part = part.drop(columns=[PARTITION_COLUMN])
+                    table = pa.Table.from_pandas(
+                        part, schema=schema, preserve_index=False
+                    )
+                    if language not in writers:
+                        files[language] = fs.open(
+                            partition_path(catalog_path, language), "wb"
+                        )
+                        writers[language] = pq.ParquetWriter(files[language], schema)
+                    writers[language].write_table(table)
+                    rows[language] = rows.get(language, 0) + len(part)
+    finally:
+        for language, writer in writers.items():
+            writer.close()
+            files[language].close()
+    return rows
+
+
+def iter_chunks(
+    fs,
+    catalog_path: str,
+    csv_path: str,
+    language: str,
+    columns: list,
+    batch_size: int = BATCH_SIZE,
+):
+    """
+    Yield the notes of `language` as DataFrames of at most `batch_size` rows,
+    with only `columns`, from the catalog if it has been built, otherwise from
+    the CSV.
+    """
+    path = partition_path(catalog_path, language)
+    if fs.exists(path):
+        with fs.open(path, "rb") as f:
+            parquet = pq.ParquetFile(f)
+            for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+                yield batch.to_pandas()
+        return
+
+    with fs.open(csv_path, "r") as f:
+        for chunk in pd.read_csv(
+            f, usecols=columns + [PARTITION_COLUMN], chunksize=batch_size
+        ):
+            if language == MISSING_LANGUAGE:
+                chunk = chunk[chunk[PARTITION_COLUMN].isna()]
+            else:
+                chunk = chunk[chunk[PARTITION_COLUMN] == language]
+            yield chunk.drop(columns=[PARTITION_COLUMN])
+
+
+def _isin(values: pd.Series, names: set) -> pd.Series:
+    # Series.isin hashes all of `names` on every call, which for a large set
+    # costs far more than one set lookup per row of the batch
+    return values.map(names.__contains__).astype(bool)
+
+
+def read_notes(
+    fs,
+    catalog_path: str,
+    csv_path: str,
+    language: str,
+    columns: list,
+    image_names: set,
+    limit: int = None,
+) -> pd.DataFrame:
+    """
+    Stream the notes of `language` whose image is in `image_names`, keeping the
+    first note of every image and stopping after `limit` notes.
+    """
+    notes = []
+    seen = set()
+    n = 0
+    for chunk in iter_chunks(fs, catalog_path, csv_path, language, columns):
+        chunk = chunk[_isin(chunk["image_name"], image_names)]
+        chunk = chunk.drop_duplicates(subset=["image_name"])
+        chunk = chunk[~_isin(chunk["image_name"], seen)]
+        if limit is not None:
+            chunk = chunk.head(limit - n)
+        seen.update(chunk["image_name"])
+        notes.append(chunk)
+        n += len(chunk)
+        if limit is not None and n >= limit:
+            break
+    if not notes:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(notes, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the language-partitioned notes catalog."
+    )
+    parser.add_argument("csv_path", help="bucket path of the notes CSV")
+    parser.add_argument("catalog_path", help="bucket path of the catalog to write")
+    parser.add_argument("--id-col", default="tweet_id")
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE)
+    args = parser.parse_args()
+
+    rows = convert(
+        storage.from_config(),
+        args.csv_path,
+        args.catalog_path,
+        id_col=args.id_col,
+        chunksize=args.chunksize,
+    )
+    for language, n in sorted(rows.items()):
+        print(f"{language}: {n} notes")
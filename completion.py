@@ -0,0 +1,237 @@
+"""
+Append-only completion records.
+
+Every confirmed item is written as its own tiny shard object, named after the
+item and the worker who confirmed it, so a confirm is a single small write that
+never touches the shared done file. Readers merge the done file (the snapshot)
+with the shard listing; once enough shards pile up they are folded back into
+the snapshot and deleted.
+
+Snapshot lines are either a bare item id (the legacy done-file format) or
+"item,worker_id". Keyed records are deduplicated, so folding the same shard
+twice never inflates the counts.
+
+Compaction assumes a single server process per bucket, which is how the apps
+are deployed: `_compaction_lock` only serialises the threads of one process.
+Two processes compacting at once can each overwrite the snapshot with their
+own merge and delete shards that only the other one folded in, losing those
+completions. When running more than one process, build the CompletionIndex of
+all but one of them with `compact_after=0`.
+"""
+
+import os
+import threading
+from collections import Counter
+from time import time
+from urllib.parse import quote, unquote
+
+import write_behind
+
+COMPACT_AFTER = 500  # fold shards into the snapshot once there are this many
+REFRESH_INTERVAL = 5  # seconds between two listings of the shard folder
+SHARD_SUFFIX = ".txt"
+
+_compaction_lock = threading.Lock()
+
+
+def shard_folder(done_file: str) -> str:
+    root, _ = os.path.splitext(done_file)
+    return f"{root}_shards/"
+
+
+def shard_name(item, worker_id) -> str:
+    return (
+        f"{quote(str(item), safe='')}__{quote(str(worker_id), safe='')}{SHARD_SUFFIX}"
+    )
+
+
+def parse_shard_name(path: str) -> tuple:
+    name = os.path.basename(path)[: -len(SHARD_SUFFIX)]
+    item, _, worker_id = name.partition("__")
+    return unquote(item), unquote(worker_id)
+
+
+def parse_record(line: str) -> tuple:
+    item, _, worker_id = line.strip().partition(",")
+    return item, worker_id or None
+
+
+def format_record(item, worker_id) -> str:
+    return f"{item},{worker_id}\n"
+
+
+def record_completion(fs, done_file: str, item, worker_id: str):
+    """
+    Record that `worker_id` confirmed `item` with a single small write.
+    """
+    path = shard_folder(done_file) + shard_name(item, worker_id)
+    with fs.open(path, "w") as f:
+        f.write(format_record(item, worker_id))
+
+
+def list_shards(fs, done_file: str) -> list:
+    return sorted(fs.glob(f"{shard_folder(done_file)}*{SHARD_SUFFIX}"))
+
+
+def read_snapshot(fs, done_file: str) -> list:
+    if not fs.exists(done_file):
+        return []
+    lines = fs.open(done_file, "r").read().split("\n")
+    return [parse_record(line) for line in lines if line.strip()]
+
+
+def snapshot_generation(fs, done_file: str):
+    """
+    A token that changes whenever the snapshot object is rewritten.
+    """
+    if not fs.exists(done_file):
+        return None
+    info = fs.info(done_file)
+    return info.get("generation") or (info.get("size"), info.get("mtime"))
+
+
+def merge_records(snapshot: list, shards: list) -> list:
+    """
+    Merge snapshot records with shard paths into a list of (item, worker_id).
+    Legacy records without a worker id are all kept, keyed records only once.
+    """
+    records = []
+    seen = set()
+    for item, worker_id in snapshot + [parse_shard_name(p) for p in shards]:
+        if worker_id is not None:
+            if (item, worker_id) in seen:
+                continue
+            seen.add((item, worker_id))
+        records.append((item, worker_id))
+    return records
+
+
+def compact(fs, done_file: str, shards: list = None):
+    """
+    Fold the current shards into the snapshot and delete them.
+
+    Shards are listed before the snapshot is read, so a shard deleted by an
+    earlier compaction is always already part of the snapshot we read. The
+    snapshot is written synchronously, also through a DeferredFileSystem, and
+    the shards are only deleted once it is in the bucket; if the write fails
+    they are kept for the next compaction. Only one process may compact a
+    bucket, see the module docstring.
+    """
+    with _compaction_lock:
+        if shards is None:
+            shards = list_shards(fs, done_file)
+        if not shards:
+            return
+        records = merge_records(read_snapshot(fs, done_file), shards)
+        s = "".join(
+            f"{item}\n" if worker_id is None else format_record(item, worker_id)
+            for item, worker_id in records
+        )
+        try:
+            write_behind.write_now(fs, done_file, s)
+        except Exception:
+            return
+        fs.rm(shards)
+
+
+class CompletionIndex:
+    """
+    Process-wide completion counts, kept up to date incrementally.
+
+    The snapshot is only downloaded again when its generation changes (i.e.
+    after a compaction); otherwise a refresh lists the shard folder and parses
+    the names of shards it has not seen yet.
+    """
+
+    def __init__(
+        self,
+        fs,
+        done_file: str,
+        threshold: int,
+        refresh_interval: float = REFRESH_INTERVAL,
+        compact_after: int = COMPACT_AFTER,
+    ):
+        self.fs = fs
+        self.done_file = done_file
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.compact_after = compact_after
+        self._counts = Counter()
+        self._legacy = Counter()
+        self._keys = set()
+        self._complete = set()
+        self._seen_shards = set()
+        self._generation = None
+        self._last_refresh = None
+        self._lock = threading.RLock()
+
+    def _add(self, item: str, n: int = 1):
+        self._counts[item] += n
+        if self._counts[item] >= self.threshold:
+            self._complete.add(item)
+        else:
+            self._complete.discard(item)
+
+    def _add_record(self, item: str, worker_id: str):
+        if (item, worker_id) in self._keys:
+            return
+        self._keys.add((item, worker_id))
+        self._add(item)
+
+    def refresh(self, force: bool = False):
+        with self._lock:
+            now = time()
+            if (
+                not force
+                and self._last_refresh is not None
+                and now - self._last_refresh < self.refresh_interval
+            ):
+                return
+            self._last_refresh = now
+
+            # list before reading the snapshot, see `compact`
+            shards = list_shards(self.fs, self.done_file)
+            generation = snapshot_generation(self.fs, self.done_file)
+            if generation != self._generation:
+                snapshot = read_snapshot(self.fs, self.done_file)
+                legacy = Counter(item for item, w in snapshot if w is None)
+                for item in set(legacy) | set(self._legacy):
+                    self._add(item, legacy[item] - self._legacy[item])
+                self._legacy = legacy
+                for item, worker_id in snapshot:
+                    if worker_id is not None:
+                        self._add_record(item, worker_id)
+                self._generation = generation
+
+            for path in shards:
+                if path not in self._seen_shards:
+                    self._add_record(*parse_shard_name(path))
+            self._seen_shards = set(shards)
+
+            if self.compact_after and len(shards) >= self.compact_after:
+                compact(self.fs, self.done_file, shards)
+
+    def record(self, item, worker_id: str):
+        """
+        Write a completion shard and count it locally straight away.
+        """
+        record_completion(self.fs, self.done_file, item, worker_id)
+        with self._lock:
+            self._add_record(str(item), worker_id)
+
+    def count(self, item) -> int:
+        return self._counts.get(str(item), 0)
+
+    def counts(self) -> dict:
+        """
+        {item: completions} of every item with at least one.
+        """
+        with self._lock:
+            return dict(self._counts)
+
+    def is_complete(self, item) -> bool:
+        return str(item) in self._complete
+
+    def complete_items(self) -> frozenset:
+        with self._lock:
+            return frozenset(self._complete)
@@ -0,0 +1,70 @@
+"""
+Process-wide image byte cache.
+
+One LRU cache of image bytes keyed by path, shared by every session of the
+process, so an image that several workers see is kept once. The cache holds
+at most `max_bytes` of image data and evicts the least recently used images
+to stay under it. Hits, misses and evictions are counted for the debug
+sidebar.
+"""
+
+import threading
+from collections import OrderedDict
+
+MAX_BYTES = 256 * 1024 * 1024
+
+
+class ImageCache:
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0  # bytes currently cached
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._images = OrderedDict()  # path -> bytes, least recently used first
+        self._lock = threading.Lock()
+
+    def __contains__(self, path: str) -> bool:
+        with self._lock:
+            return path in self._images
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def get(self, path: str) -> bytes:
+        """
+        The cached bytes of `path`, or None.
+        """
+        with self._lock:
+            data = self._images.get(path)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._images.move_to_end(path)
+            return data
+
+    def put(self, path: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return  # would evict everything else and still not fit
+        with self._lock:
+            old = self._images.pop(path, None)
+            if old is not None:
+                self.size -= len(old)
+            self._images[path] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "images": len(self._images),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
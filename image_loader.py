@@ -0,0 +1,100 @@
+"""
+Item-at-a-time image loading with lookahead.
+
+`ImageLoader.get` fetches the image of the current item and returns as soon as
+that one object is read, while the next few images of the session are fetched
+in the background so they are ready by the time the worker gets to them.
+Fetched images are kept in an image_cache.ImageCache shared by all sessions
+of the process.
+
+`ImageLoader.fetch_all` reads a whole batch of images concurrently, for when
+all of them are needed at once.
+
+A read that hangs is cut off by the storage backend (see
+storage.REQUEST_TIMEOUT), so it can't hold a worker of the pool forever, and
+nobody waits for an image longer than FETCH_TIMEOUT: an image that isn't there
+by then counts as a miss, and the next call tries again.
+"""
+
+import math
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import image_cache
+
+LOOKAHEAD = 3  # images prefetched after the current one
+MAX_WORKERS = 8
+FETCH_TIMEOUT = 10  # seconds to wait for a single read
+
+
+class ImageLoader:
+    def __init__(
+        self, fs, cache: image_cache.ImageCache = None, max_workers: int = MAX_WORKERS
+    ):
+        self.fs = fs
+        self.cache = cache if cache is not None else image_cache.ImageCache()
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="image-loader"
+        )
+        self._reads = {}  # path -> Future of the image bytes, while being read
+        self._lock = threading.Lock()
+
+    def _read(self, path: str) -> bytes:
+        try:
+            data = self.fs.open(path, "rb").read()
+            self.cache.put(path, data)
+            return data
+        finally:
+            with self._lock:
+                self._reads.pop(path, None)
+
+    def _future(self, path: str) -> Future:
+        data = self.cache.get(path)
+        if data is not None:
+            future = Future()
+            future.set_result(data)
+            return future
+        with self._lock:
+            future = self._reads.get(path)
+            if future is None:
+                future = self._executor.submit(self._read, path)
+                self._reads[path] = future
+            return future
+
+    def prefetch(self, paths: list):
+        for path in paths:
+            if path not in self.cache:
+                with self._lock:
+                    if path not in self._reads:
+                        self._reads[path] = self._executor.submit(self._read, path)
+
+    def get(
+        self, path: str, lookahead: list = (), timeout: float = FETCH_TIMEOUT
+    ) -> bytes:
+        """
+        Return the image at `path`, or None if it couldn't be read within
+        `timeout`, and start fetching `lookahead` in the background.
+        """
+        future = self._future(path)
+        self.prefetch(lookahead)
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            return None  # timed out or failed, a later call tries again
+
+    def fetch_all(self, paths: list, timeout: float = FETCH_TIMEOUT) -> dict:
+        """
+        Read `paths` concurrently, at most `max_workers` at a time, and return
+        {path: bytes} for the ones that could be read. Images that fail or
+        don't arrive in time are left out; a later call retries them.
+        """
+        futures = {path: self._future(path) for path in dict.fromkeys(paths)}
+        # the reads run in waves of max_workers, each read gets `timeout`
+        waves = math.ceil(len(futures) / self.max_workers)
+        wait(futures.values(), timeout=timeout * waves)
+        return {
+            path: future.result()
+            for path, future in futures.items()
+            if future.done() and not future.exception()
+        }
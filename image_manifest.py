@@ -0,0 +1,129 @@
+"""
+Image manifest.
+
+A single CSV listing every image the apps can show, with its name, folder,
+size in bytes, dimensions, content hash and a tiny blurred preview (a
+base64 JPEG of a few hundred bytes). The apps load it once instead of listing
+the image folders of the bucket, use it to find the folder an image lives in,
+and paint the preview while the full image loads.
+
+The preprocessing pipeline writes it; for images that are already in the
+bucket it can be built with:
+
+    python image_manifest.py annotation-experiment/static/resized_images/ \\
+        annotation-experiment/static/qualification_images/
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import os
+
+import pandas as pd
+from PIL import Image, ImageFilter
+
+import storage
+
+MANIFEST = "annotation-experiment/static/image_manifest.csv"
+COLUMNS = ["name", "folder", "size", "width", "height", "sha256", "preview"]
+PREVIEW_SIZE = 24  # pixels on the longest side
+PREVIEW_QUALITY = 30
+IMAGE_EXTENSIONS = (".jpeg", ".jpg", ".png", ".webp")
+
+
+def make_preview(img: Image.Image) -> str:
+    """
+    A blurred thumbnail of `img` as base64 JPEG.
+    """
+    img.draft("RGB", (PREVIEW_SIZE, PREVIEW_SIZE))
+    img = img.convert("RGB")
+    img.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE))
+    img = img.filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=PREVIEW_QUALITY, optimize=True)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def describe(name: str, folder: str, data: bytes) -> dict:
+    img = Image.open(io.BytesIO(data))
+    width, height = img.size
+    return {
+        "name": name,
+        "folder": folder,
+        "size": len(data),
+        "width": width,
+        "height": height,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "preview": make_preview(img),
+    }
+
+
+def build_manifest(fs, folders: list) -> pd.DataFrame:
+    rows = []
+    for folder in folders:
+        for path in fs.glob(f"{folder}*"):
+            if not path.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            data = fs.open(path, "rb").read()
+            rows.append(describe(os.path.basename(path), folder, data))
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def write_manifest(fs, manifest: pd.DataFrame, path: str = MANIFEST):
+    with fs.open(path, "w") as f:
+        f.write(manifest[COLUMNS].to_csv(index=False))
+
+
+def load_manifest(fs, path: str = MANIFEST) -> pd.DataFrame:
+    """
+    The manifest indexed by image name, or None if it hasn't been written.
+    """
+    if not fs.exists(path):
+        return None
+    manifest = pd.read_csv(fs.open(path, "r"))
+    if "preview" not in manifest:
+        manifest["preview"] = None  # written before previews were added
+    manifest.set_index("name", inplace=True, drop=False)
+    return manifest
+
+
+def list_images(fs, manifest: pd.DataFrame, folder: str, extension: str) -> set:
+    """
+    Names of the images in `folder`, from the manifest if there is one.
+    """
+    if manifest is None:
+        return {os.path.basename(p) for p in fs.glob(f"{folder}*{extension}")}
+    names = manifest.loc[manifest["folder"] == folder, "name"]
+    return set(names[names.str.endswith(extension)])
+
+
+def image_path(manifest: pd.DataFrame, image_name: str, default_folder: str) -> str:
+    if manifest is not None and image_name in manifest.index:
+        folder = manifest.loc[[image_name], "folder"].iloc[0]
+        return f"{folder}{image_name}"
+    return f"{default_folder}{image_name}"
+
+
+def preview(manifest: pd.DataFrame, image_name: str) -> bytes:
+    """
+    The preview JPEG of an image, or None if the manifest has none.
+    """
+    if manifest is None or image_name not in manifest.index:
+        return None
+    data = manifest.loc[[image_name], "preview"].iloc[0]
+    if not isinstance(data, str):
+        return None
+    return base64.b64decode(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the image manifest.")
+    parser.add_argument("folders", nargs="+", help="bucket folders, ending in /")
+    parser.add_argument("--manifest", default=MANIFEST)
+    args = parser.parse_args()
+
+    fs = storage.from_config()
+    manifest = build_manifest(fs, args.folders)
+    write_manifest(fs, manifest, args.manifest)
+    print(f"{len(manifest)} images written to {args.manifest}")
@@ -0,0 +1,137 @@
+"""
+Image URLs.
+
+Instead of pushing image bytes through the Streamlit websocket, the apps can
+hand the browser a URL to fetch the image from, so repeat views are served
+from the browser's (or a proxy's) cache and never touch the Python process.
+The IMAGE_SERVING environment variable picks how:
+
+- `bytes` (default): the apps read the images and send the bytes.
+- `signed`: time-limited signed URLs to the bucket objects (`fs.sign`). The
+  URL of an image is reused until it is close to expiring so browsers can
+  cache it; preprocess_images.py sets the Cache-Control metadata of the
+  objects it writes with `set_cache_control`.
+- `static`: plain URLs under IMAGE_BASE_URL, which points at the
+  `annotation-experiment/static/` folder, e.g. a CDN in front of it or, for
+  testing, the local static server of this module:
+
+      python image_urls.py --port 8502
+
+  which serves the images under the local `static/` folder (and nothing
+  else) with caching headers.
+"""
+
+import argparse
+import functools
+import hashlib
+import http.server
+import os
+import threading
+from time import time
+
+import storage
+
+CACHE_CONTROL = "public, max-age=86400, immutable"
+SIGNED_URL_SECONDS = 60 * 60
+STATIC_ROOT = "static"  # annotation-experiment/static/ in the local layout
+IMAGE_EXTENSIONS = {".jpeg", ".jpg", ".png", ".webp"}
+
+
+def static_url(base_url: str, path: str, bucket: str = storage.BUCKET) -> str:
+    prefix = f"{bucket}/static/"
+    if not path.startswith(prefix):
+        raise ValueError(f"{path} is not under {prefix}")
+    return base_url.rstrip("/") + "/" + path.removeprefix(prefix)
+
+
+class SignedURLs:
+    """
+    Signed URLs of the bucket objects, re-signed once less than half of their
+    lifetime is left.
+    """
+
+    def __init__(self, fs, expiration: int = SIGNED_URL_SECONDS):
+        self.fs = fs
+        self.expiration = expiration
+        self._urls = {}  # path -> (url, expiry)
+        self._lock = threading.Lock()
+
+    def url(self, path: str) -> str:
+        now = time()
+        with self._lock:
+            url, expiry = self._urls.get(path, (None, 0))
+        if expiry - now < self.expiration / 2:
+            url = self.fs.sign(path, expiration=self.expiration)
+            with self._lock:
+                self._urls[path] = (url, now + self.expiration)
+        return url
+
+
+def set_cache_control(fs, paths: list, cache_control: str = CACHE_CONTROL):
+    """
+    Set the Cache-Control metadata of bucket objects, which GCS sends with
+    signed URL responses. Other backends keep no metadata and are skipped.
+    """
+    if getattr(fs, "name", None) != "gcs":
+        return
+    for path in paths:
+        fs.setxattrs(path, fixed_key_metadata={"cache_control": cache_control})
+
+
+class CachingHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    The image files under the served directory, with Cache-Control and ETag
+    headers, answering conditional requests with 304. Anything else, including
+    directory listings and files reached through links out of the directory,
+    is a 404.
+    """
+
+    def _is_image(self, path: str) -> bool:
+        root = os.path.realpath(self.directory)
+        path = os.path.realpath(path)
+        return (
+            path.startswith(root + os.sep)
+            and os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+            and os.path.isfile(path)
+        )
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not self._is_image(path):
+            self.send_error(404)
+            return None
+        if self.headers.get("If-None-Match") == _etag(path):
+            self.send_response(304)
+            self.end_headers()  # adds the caching headers
+            return None
+        return super().send_head()
+
+    def end_headers(self):
+        path = self.translate_path(self.path)
+        if self._is_image(path):
+            self.send_header("ETag", _etag(path))
+            self.send_header("Cache-Control", CACHE_CONTROL)
+        super().end_headers()
+
+
+def _etag(path: str) -> str:
+    stat = os.stat(path)
+    key = f"{stat.st_size}-{stat.st_mtime_ns}".encode()
+    return '"' + hashlib.sha1(key).hexdigest() + '"'
+
+
+def serve(root: str, port: int):
+    handler = functools.partial(CachingHandler, directory=root)
+    server = http.server.ThreadingHTTPServer(("", port), handler)
+    print(f"Serving {root} on http://localhost:{port}/")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve the local static images with caching headers."
+    )
+    parser.add_argument("--root", default=STATIC_ROOT)
+    parser.add_argument("--port", type=int, default=8502)
+    args = parser.parse_args()
+    serve(args.root, args.port)
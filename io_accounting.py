@@ -0,0 +1,250 @@
+"""
+I/O accounting for the storage backends.
+
+`AccountingStorage` wraps a backend and counts the calls made through it and
+the bytes they move:
+
+- `reads` / `writes`: objects opened for reading / writing, i.e. round trips
+  to the bucket, and `bytes_read` / `bytes_written` (characters for text
+  files);
+- `full_reads`: objects read through to the end;
+- `exists`, `globs`, `infos` and `rms`: metadata calls.
+
+The counts go to the totals of the process, to the counter of the Streamlit
+rerun running on the calling thread (see `IOAccounting.begin_rerun`) and to
+the totals of the worker of that rerun. I/O made on background threads, such
+as image prefetching, only counts towards the totals.
+
+`IOAccounting.budget` turns the counters into an assertion, e.g. that a
+confirm makes at most two writes and no full reads:
+
+    with fs.accounting.budget(writes=2, full_reads=0):
+        confirm_label(note)
+
+raises IOBudgetExceeded if it doesn't.
+"""
+
+import threading
+from contextlib import contextmanager
+
+import write_behind
+
+FIELDS = (
+    "reads",
+    "writes",
+    "full_reads",
+    "bytes_read",
+    "bytes_written",
+    "exists",
+    "globs",
+    "infos",
+    "rms",
+)
+
+
+class IOBudgetExceeded(AssertionError):
+    pass
+
+
+class IOCounter:
+    def __init__(self, worker_id: str = None):
+        self.worker_id = worker_id
+        self.counts = dict.fromkeys(FIELDS, 0)
+
+    def add(self, field: str, n: int = 1):
+        self.counts[field] += n
+
+    def __getitem__(self, field: str) -> int:
+        return self.counts[field]
+
+    def over_budget(self, **limits) -> dict:
+        """
+        {field: count} of the fields whose count is above its limit.
+        """
+        return {
+            field: self.counts[field]
+            for field, limit in limits.items()
+            if self.counts[field] > limit
+        }
+
+    def check(self, **limits):
+        over = self.over_budget(**limits)
+        if over:
+            raise IOBudgetExceeded(
+                ", ".join(
+                    f"{count} {field} (at most {limits[field]})"
+                    for field, count in over.items()
+                )
+            )
+
+    def summary(self) -> str:
+        return (
+            ", ".join(f"{n} {field}" for field, n in self.counts.items() if n) or "none"
+        )
+
+    def __repr__(self):
+        counts = ", ".join(f"{k}={v}" for k, v in self.counts.items() if v)
+        return f"IOCounter({counts})"
+
+
+class IOAccounting:
+    """
+    Counters shared by the AccountingStorage wrappers of one process.
+    """
+
+    def __init__(self):
+        self.totals = IOCounter()
+        self.workers = {}  # worker id -> IOCounter
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def count(self, field: str, n: int = 1):
+        stack = self._stack()
+        with self._lock:
+            self.totals.add(field, n)
+            for counter in stack:
+                counter.add(field, n)
+            worker_id = stack[0].worker_id if stack else None
+            if worker_id:
+                self.workers.setdefault(worker_id, IOCounter(worker_id)).add(field, n)
+
+    def begin_rerun(self, worker_id: str = None) -> IOCounter:
+        """
+        Start counting the I/O of a rerun on the calling thread, replacing the
+        counter of the previous one.
+        """
+        counter = IOCounter(worker_id)
+        self._local.stack = [counter]
+        return counter
+
+    @contextmanager
+    def measure(self, worker_id: str = None):
+        """
+        Count the I/O of the calling thread inside the `with` block.
+        """
+        counter = IOCounter(worker_id)
+        stack = self._stack()
+        stack.append(counter)
+        try:
+            yield counter
+        finally:
+            stack.remove(counter)
+
+    @contextmanager
+    def budget(self, **limits):
+        """
+        Like `measure`, and raise IOBudgetExceeded at the end of the block if a
+        count is above its limit, e.g. `budget(writes=2, full_reads=0)`.
+        """
+        with self.measure() as counter:
+            yield counter
+        counter.check(**limits)
+
+    def reset(self) -> IOCounter:
+        """
+        Start new totals and return the old ones.
+        """
+        with self._lock:
+            totals, self.totals = self.totals, IOCounter()
+        return totals
+
+
+class _AccountingFile:
+    def __init__(self, f, accounting: IOAccounting):
+        self._f = f
+        self._accounting = accounting
+        self._eof = False
+
+    def _done(self):
+        if not self._eof:
+            self._eof = True
+            self._accounting.count("full_reads")
+
+    def read(self, size: int = -1):
+        data = self._f.read(size)
+        self._accounting.count("bytes_read", len(data))
+        if size is None or size < 0 or len(data) < size:
+            self._done()
+        return data
+
+    def readline(self, size: int = -1):
+        line = self._f.readline(size)
+        self._accounting.count("bytes_read", len(line))
+        if not line:
+            self._done()
+        return line
+
+    def __iter__(self):
+        for line in self._f:
+            self._accounting.count("bytes_read", len(line))
+            yield line
+        self._done()
+
+    def write(self, data):
+        self._accounting.count("bytes_written", len(data))
+        return self._f.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+class AccountingStorage:
+    """
+    Wraps a backend (or a write_behind.DeferredFileSystem) and counts its I/O
+    in `accounting`.
+    """
+
+    def __init__(self, fs, accounting: IOAccounting = None):
+        self.fs = fs
+        self.accounting = accounting if accounting is not None else IOAccounting()
+
+    def wrap(self, fs) -> "AccountingStorage":
+        """
+        Wrap another file system, counting into the same accounting.
+        """
+        return AccountingStorage(fs, self.accounting)
+
+    def open(self, path: str, mode: str = "r"):
+        writing = "w" in mode or "a" in mode
+        self.accounting.count("writes" if writing else "reads")
+        return _AccountingFile(self.fs.open(path, mode), self.accounting)
+
+    def write_now(self, path: str, data: str):
+        self.accounting.count("writes")
+        self.accounting.count("bytes_written", len(data))
+        write_behind.write_now(self.fs, path, data)
+
+    def exists(self, path: str) -> bool:
+        self.accounting.count("exists")
+        return self.fs.exists(path)
+
+    def glob(self, pattern: str) -> list:
+        self.accounting.count("globs")
+        return self.fs.glob(pattern)
+
+    def info(self, path: str) -> dict:
+        self.accounting.count("infos")
+        return self.fs.info(path)
+
+    def rm(self, paths):
+        self.accounting.count("rms")
+        self.fs.rm(paths)
+
+    def rm_later(self, paths):
+        self.accounting.count("rms")
+        write_behind.rm_later(self.fs, paths)
+
+    def __getattr__(self, name):
+        return getattr(self.fs, name)
@@ -0,0 +1,110 @@
+"""
+In-process timing metrics.
+
+The apps time the phases of a rerun (loading the notes and the session,
+fetching the image, rendering the item, confirming it) and record the
+durations here. Every phase is aggregated into a histogram with fixed
+millisecond buckets, and every sample is appended as a JSON line to a local
+metrics log, so slow phases show up on the admin page (pages/admin.py) and
+can be analysed later without attaching a profiler.
+
+All apps of a process share the `Metrics` of a log path through
+`open_metrics`; `all_metrics` lists them for the admin page.
+"""
+
+import json
+import os
+import threading
+from time import time
+
+import pandas as pd
+
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+
+
+class Histogram:
+    def __init__(self, buckets: list = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is the overflow
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, ms: float):
+        i = 0
+        while i < len(self.buckets) and ms > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-th percentile.
+        """
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    def __init__(self, log_path: str = None):
+        self.log_path = log_path
+        self._histograms = {}  # phase -> Histogram
+        self._lock = threading.Lock()
+        if log_path:
+            os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+
+    def record(self, phase: str, ms: float, **fields):
+        with self._lock:
+            if phase not in self._histograms:
+                self._histograms[phase] = Histogram()
+            self._histograms[phase].add(ms)
+            if self.log_path:
+                line = {"time": time(), "phase": phase, "ms": ms} | fields
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps(line, default=str) + "\n")
+
+    def histograms(self) -> dict:
+        with self._lock:
+            return dict(self._histograms)
+
+    def summary(self) -> pd.DataFrame:
+        rows = [
+            {
+                "phase": phase,
+                "count": h.count,
+                "mean_ms": h.total / h.count,
+                "p50_ms": h.percentile(50),
+                "p95_ms": h.percentile(95),
+                "p99_ms": h.percentile(99),
+                "max_ms": h.max,
+            }
+            for phase, h in self.histograms().items()
+        ]
+        columns = ["phase", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms"]
+        return pd.DataFrame(rows, columns=columns + ["max_ms"])
+
+
+_opened = {}  # log path -> Metrics
+_opened_lock = threading.Lock()
+
+
+def open_metrics(log_path: str) -> Metrics:
+    with _opened_lock:
+        if log_path not in _opened:
+            _opened[log_path] = Metrics(log_path)
+        return _opened[log_path]
+
+
+def all_metrics() -> dict:
+    """
+    {log path: Metrics} of every Metrics opened in this process.
+    """
+    with _opened_lock:
+        return dict(_opened)
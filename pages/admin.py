@@ -0,0 +1,49 @@
+"""
+Admin page with the timing metrics of the running apps.
+
+Shows, for every app of this server process, how long each phase of a rerun
+takes (see metrics.py). It's protected by the ANNOTATION_ADMIN_PASSWORD
+environment variable and disabled when that isn't set.
+"""
+
+import hmac
+import os
+
+import pandas as pd
+import streamlit as st
+
+import metrics
+
+ADMIN_PASSWORD = os.environ.get("ANNOTATION_ADMIN_PASSWORD")
+
+st.title("Performance")
+
+if not ADMIN_PASSWORD:
+    st.error("The admin page is disabled. Set ANNOTATION_ADMIN_PASSWORD to enable it.")
+    st.stop()
+
+if not st.session_state.get("admin"):
+    password = st.text_input("Password", type="password")
+    if not hmac.compare_digest(password.encode(), ADMIN_PASSWORD.encode()):
+        if password:
+            st.error("Wrong password.")
+        st.stop()
+    st.session_state.admin = True
+    st.rerun()
+
+st.button("Refresh")
+
+opened = metrics.all_metrics()
+if not opened:
+    st.info("No timings recorded yet.")
+
+for log_path, app_metrics in opened.items():
+    st.header(os.path.basename(log_path))
+    st.caption(f"Logged to {log_path}")
+    st.dataframe(app_metrics.summary().round(1), hide_index=True)
+    for phase, histogram in app_metrics.histograms().items():
+        labels = [f"≤{bound} ms" for bound in histogram.buckets]
+        labels.append(f">{histogram.buckets[-1]} ms")
+        counts = pd.DataFrame({"bucket": labels, "count": histogram.counts})
+        st.subheader(phase)
+        st.bar_chart(counts, x="bucket", y="count", sort=False)
@@ -0,0 +1,236 @@
+"""
+Image preprocessing.
+
+Replaces resize_images.ipynb. Downscales the source images on all cores and
+writes, for every image:
+
+    <output>/<name>.<ext>                 the first target height
+    <output>/<height>/<name>.<format>     every target height and format
+
+sets their Cache-Control metadata on GCS (see image_urls.py), then writes the
+image manifest (see image_manifest.py) for the first kind, which is what the
+apps show, with a blurred preview of every image. The first kind keeps the
+file name of the source, extension included, since that is the name the
+notes and the apps refer to the image by, and is encoded in the format its
+extension names (a PNG for a `.png`), so it is served with the right content
+type. Sources of other types get a `.jpeg` name.
+
+Images are only decoded to the size they are needed at (JPEG draft mode,
+then `Image.reduce` by an integer factor before the final resize). An image
+is skipped when the version of its source (the md5 or etag of the object, or
+its size and mtime where the backend has neither) is the one of the last run
+and the outputs that run recorded are the ones asked for, so an unchanged
+image costs one metadata lookup and is neither downloaded nor checked for in
+the bucket.
+
+    python preprocess_images.py "annotation-experiment/static/images/*.png" \\
+        annotation-experiment/static/resized_images/ --heights 600 300
+
+It uses the storage backend from the environment, see storage.py.
+"""
+
+import argparse
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from PIL import Image
+
+import image_manifest
+import image_urls
+import storage
+
+HEIGHTS = [600]
+FORMATS = ["jpeg", "webp"]
+QUALITY = {"jpeg": 85, "webp": 80}
+MAIN_FORMATS = {".png": "png", ".jpg": "jpeg", ".jpeg": "jpeg", ".webp": "webp"}
+STATE_FILE = "preprocess_state.json"  # per source: version, outputs, manifest row
+
+
+def main_format(path: str) -> str:
+    return MAIN_FORMATS[os.path.splitext(path)[1].lower()]
+
+
+def output_paths(output: str, source: str, heights: list, formats: list) -> dict:
+    """
+    {(height, format): path} of the outputs of the image at `source`.
+    """
+    name, extension = os.path.splitext(os.path.basename(source))
+    paths = {
+        (height, fmt): f"{output}{height}/{name}.{fmt}"
+        for height in heights
+        for fmt in formats
+    }
+    if extension.lower() not in MAIN_FORMATS:
+        extension = ".jpeg"
+    paths[(heights[0], "main")] = f"{output}{name}{extension}"
+    return paths
+
+
+def recorded_outputs(paths: dict) -> list:
+    """
+    [path, format] of every output, as kept in the state file.
+    """
+    return sorted(
+        [path, main_format(path) if fmt == "main" else fmt]
+        for (_, fmt), path in paths.items()
+    )
+
+
+def source_version(info: dict) -> str:
+    """
+    A token that changes whenever the content of an object does.
+    """
+    for key in ("md5Hash", "etag", "ETag"):
+        if info.get(key):
+            return str(info[key])
+    return f"{info.get('size')}-{info.get('mtime')}"
+
+
+def downscale(img: Image.Image, height: int) -> Image.Image:
+    if img.height <= height:
+        return img
+    factor = img.height // height
+    if factor >= 2:
+        img = img.reduce(factor)  # cheap integer box downscale, still >= height
+    width = max(1, round(img.width * height / img.height))
+    return img.resize((width, height), Image.LANCZOS)
+
+
+def encode(img: Image.Image, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    if fmt in QUALITY:
+        img.save(buffer, fmt.upper(), quality=QUALITY[fmt])
+    else:
+        img.save(buffer, fmt.upper(), optimize=True)
+    return buffer.getvalue()
+
+
+def process(source: str, output: str, heights: list, formats: list) -> dict:
+    """
+    Write the outputs of one source image. Returns the manifest row of its
+    main output.
+    """
+    fs = storage.from_config()
+    data = fs.open(source, "rb").read()
+    paths = output_paths(output, source, heights, formats)
+    img = Image.open(io.BytesIO(data))
+    largest = max(heights)
+    if img.height > largest:
+        # let the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding
+        img.draft("RGB", (round(img.width * largest / img.height), largest))
+    img = img.convert("RGB")
+
+    row = None
+    for height in sorted(heights, reverse=True):
+        img = downscale(img, height)
+        for (h, fmt), path in paths.items():
+            if h != height:
+                continue
+            encoded = encode(img, main_format(path) if fmt == "main" else fmt)
+            with fs.open(path, "wb") as f:
+                f.write(encoded)
+            if fmt == "main":
+                row = image_manifest.describe(os.path.basename(path), output, encoded)
+    image_urls.set_cache_control(fs, list(paths.values()))
+    return row
+
+
+def load_state(fs, output: str) -> dict:
+    path = f"{output}{STATE_FILE}"
+    if not fs.exists(path):
+        return {}
+    return json.loads(fs.open(path, "r").read())
+
+
+def preprocess(
+    fs,
+    pattern: str,
+    output: str,
+    heights: list = HEIGHTS,
+    formats: list = FORMATS,
+    manifest_path: str = image_manifest.MANIFEST,
+    workers: int = None,
+) -> dict:
+    """
+    Preprocess every image matching `pattern` into `output` and update the
+    manifest. Returns the number of images processed and skipped.
+    """
+    sources = fs.glob(pattern)
+    state = load_state(fs, output)
+    manifest = image_manifest.load_manifest(fs, manifest_path)
+    listed = set()
+    if manifest is not None:
+        listed = set(manifest.loc[manifest["folder"] == output, "name"])
+
+    versions, todo = {}, []
+    for source in sources:
+        versions[source] = source_version(fs.info(source))
+        known = state.get(source, {})
+        paths = output_paths(output, source, heights, formats)
+        if (
+            known.get("version") != versions[source]
+            or known.get("outputs") != recorded_outputs(paths)
+            or os.path.basename(paths[(heights[0], "main")]) not in listed
+        ):
+            todo.append(source)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            source: executor.submit(process, source, output, heights, formats)
+            for source in todo
+        }
+        for source, future in futures.items():
+            state[source] = {
+                "version": versions[source],
+                "outputs": recorded_outputs(
+                    output_paths(output, source, heights, formats)
+                ),
+                "manifest": future.result(),
+            }
+
+    with fs.open(f"{output}{STATE_FILE}", "w") as f:
+        f.write(json.dumps(state, indent=1, sort_keys=True))
+
+    # only the rows of the images of this run are rewritten: other folders,
+    # and other images of `output` (e.g. the ones of another study), are kept
+    names = {state[source]["manifest"]["name"] for source in sources}
+    rows = []
+    if manifest is not None:
+        rows = manifest[(manifest["folder"] != output) | ~manifest["name"].isin(names)]
+    rows = pd.concat(
+        [
+            pd.DataFrame(rows, columns=image_manifest.COLUMNS),
+            pd.DataFrame(
+                [state[source]["manifest"] for source in sources],
+                columns=image_manifest.COLUMNS,
+            ),
+        ],
+        ignore_index=True,
+    )
+    image_manifest.write_manifest(fs, rows, manifest_path)
+    return {"processed": len(todo), "skipped": len(sources) - len(todo)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Downscale the annotation images.")
+    parser.add_argument("pattern", help="bucket glob of the source images")
+    parser.add_argument("output", help="bucket folder to write to, ending in /")
+    parser.add_argument("--heights", type=int, nargs="+", default=HEIGHTS)
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=FORMATS)
+    parser.add_argument("--manifest", default=image_manifest.MANIFEST)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    counts = preprocess(
+        storage.from_config(),
+        args.pattern,
+        args.output,
+        heights=args.heights,
+        formats=args.formats,
+        manifest_path=args.manifest,
+        workers=args.workers,
+    )
+    print(f"{counts['processed']} images processed, {counts['skipped']} unchanged")
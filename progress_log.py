@@ -0,0 +1,120 @@
+"""
+Append-only worker progress.
+
+The progress CSV of a worker is written once, when their session is created.
+After that every confirmed item is saved as its own small JSON record next to
+it, so a confirm writes one answer instead of the whole session. Loading a
+session replays the records on top of the CSV, and folds them back into the
+CSV once there are `CONSOLIDATE_AFTER` of them.
+
+While an item is being answered, `save_checkpoint` keeps the answers given so
+far in one small object per item, overwritten on every answer, in a folder of
+its own so replaying a session never reads them. A worker who reconnects
+halfway through an item resumes from `load_checkpoint`. Once the item is
+answered, `drop_checkpoint` queues the deletion of its checkpoint, so the
+folder only holds the items being answered.
+"""
+
+import io
+import json
+import os
+
+import pandas as pd
+
+import write_behind
+
+CONSOLIDATE_AFTER = 10
+RECORD_SUFFIX = ".json"
+
+
+def records_folder(progress_file: str) -> str:
+    root, _ = os.path.splitext(progress_file)
+    return f"{root}/"
+
+
+def append_record(fs, progress_file: str, seq: int, item, values: dict):
+    """
+    Save the `values` of one progress row. `seq` orders the records of a
+    worker, e.g. the number of items they have confirmed so far.
+    """
+    path = f"{records_folder(progress_file)}{seq:05d}_{item}{RECORD_SUFFIX}"
+    record = {"item": str(item), "values": values}
+    with fs.open(path, "w") as f:
+        f.write(json.dumps(record))
+
+
+def checkpoint_path(progress_file: str, item) -> str:
+    root, _ = os.path.splitext(progress_file)
+    return f"{root}_checkpoints/{item}{RECORD_SUFFIX}"
+
+
+def save_checkpoint(fs, progress_file: str, item, checkpoint: dict):
+    """
+    Save the partial answer to `item`, replacing the previous one.
+    """
+    with fs.open(checkpoint_path(progress_file, item), "w") as f:
+        f.write(json.dumps(checkpoint))
+
+
+def load_checkpoint(fs, progress_file: str, item) -> dict:
+    """
+    The last checkpoint saved for `item`, or None if there is none.
+    """
+    path = checkpoint_path(progress_file, item)
+    if not fs.exists(path):
+        return None
+    return json.loads(fs.open(path, "r").read())
+
+
+def drop_checkpoint(fs, progress_file: str, item):
+    """
+    Delete the checkpoint of an answered item, after its queued writes.
+    """
+    write_behind.rm_later(fs, [checkpoint_path(progress_file, item)])
+
+
+def list_records(fs, progress_file: str) -> list:
+    return sorted(fs.glob(f"{records_folder(progress_file)}*{RECORD_SUFFIX}"))
+
+
+def replay(progress: pd.DataFrame, records: list) -> pd.DataFrame:
+    rows = {str(i): i for i in progress.index}
+    for record in records:
+        index = rows.get(record["item"])
+        if index is None:
+            continue
+        for column, value in record["values"].items():
+            if column not in progress.columns:
+                progress[column] = None
+            if progress[column].dtype != object:
+                progress[column] = progress[column].astype(object)
+            progress.at[index, column] = value
+    return progress
+
+
+def consolidate(fs, progress_file: str, progress: pd.DataFrame, records: list):
+    """
+    Write the replayed session back to the CSV and drop the folded records.
+    The CSV is written synchronously, so the records are only deleted once it
+    is in the bucket; if the write fails they are kept.
+    """
+    try:
+        write_behind.write_now(fs, progress_file, progress.to_csv(index=False))
+    except Exception:
+        return
+    fs.rm(records)
+
+
+def load_progress(
+    fs, progress_file: str, id_col: str, consolidate_after: int = CONSOLIDATE_AFTER
+) -> pd.DataFrame:
+    progress = fs.open(progress_file, "r").read()
+    progress = pd.read_csv(io.StringIO(progress))
+    progress.set_index(id_col, inplace=True, drop=False)
+
+    paths = list_records(fs, progress_file)
+    records = [json.loads(fs.open(path, "r").read()) for path in paths]
+    progress = replay(progress, records)
+    if consolidate_after and len(paths) >= consolidate_after:
+        consolidate(fs, progress_file, progress, paths)
+    return progress
@@ -0,0 +1,107 @@
+"""
+Compiled question tree of the visual evidence flow app.
+
+`question_tree.yaml` nests every follow-up question inside the answer that
+leads to it. `QuestionTree` flattens it once, when the app loads it, into a
+table of nodes indexed by id, each with its answers as shown to the annotator,
+whether an explanation is mandatory, whether several answers can be picked and
+the id of the node every answer leads to. A session then only keeps the id of
+its current node (its cursor) and `QuestionTree.next` moves it along in
+constant time, instead of walking the tree from the root on every rerun.
+
+The top-level keys of the YAML are the sections of the tree, asked in the
+order they are written in. A section may set a `title` next to its first
+question; otherwise it's named after its key, e.g. "Text in image related
+questions".
+
+A node's id is its section followed by the answers that lead to it, e.g.
+`image/No/Other`, so a cursor stays meaningful across restarts of the app.
+An answer that leads to a label, or any answer of a multiple-answer question,
+ends the section; the cursor then moves to the first question of the next
+section, and to None once the last section is done.
+"""
+
+
+def section_title(section: str, spec: dict) -> str:
+    default = f"{section.replace('_', ' ').capitalize()} related questions"
+    return spec.get("title", default)
+
+
+def is_mandatory_text(spec: dict) -> bool:
+    """
+    `mandatory_text` is either False or "required-<answer>"; the explanation is
+    optional when <answer> is "None".
+    """
+    value = spec.get("mandatory_text", False)
+    if value is False:
+        return False
+    return value.split("-")[1] != "None"
+
+
+class Node:
+    def __init__(self, node_id: str, section: str, title: str, depth: int, spec: dict):
+        self.id = node_id
+        self.section = section
+        self.title = title  # of the section
+        self.depth = depth  # 0 for the first question of the section
+        self.question = spec["question"]
+        self.explanation = spec["explanation"]
+        self.mandatory_text = is_mandatory_text(spec)
+        self.multi = bool(spec.get("multiple_answers", False))
+        self.answers = sorted(
+            (str(answer).capitalize() for answer in spec["answers"]), reverse=True
+        )
+        self.successors = {}  # answer -> id of the node it leads to
+        self.exit = None  # id of the node after the section, None after the last
+
+
+class QuestionTree:
+    def __init__(self, tree: dict, max_depth: int):
+        """
+        Compile the parsed YAML `tree`. Raises ValueError if a section is more
+        than `max_depth` questions deep.
+        """
+        self.sections = list(tree)
+        self.nodes = {}
+        for section in self.sections:
+            title = section_title(section, tree[section])
+            self._compile(section, tree[section], section, title, 0)
+            depth = max(
+                node.depth + 1
+                for node in self.nodes.values()
+                if node.section == section
+            )
+            if depth > max_depth:
+                raise ValueError(
+                    f"The {section} questions are {depth} deep,"
+                    f" more than the {max_depth} the app allows"
+                )
+        for node in self.nodes.values():
+            i = self.sections.index(node.section)
+            if i + 1 < len(self.sections):
+                node.exit = self.sections[i + 1]
+
+    def _compile(self, node_id: str, spec: dict, section: str, title: str, depth: int):
+        node = Node(node_id, section, title, depth, spec)
+        self.nodes[node_id] = node
+        if node.multi:
+            return
+        for answer, follow_up in spec["answers"].items():
+            if isinstance(follow_up, dict) and "question" in follow_up:
+                answer = str(answer).capitalize()
+                child_id = f"{node_id}/{answer}"
+                node.successors[answer] = child_id
+                self._compile(child_id, follow_up, section, title, depth + 1)
+
+    def start(self) -> str:
+        return self.sections[0]
+
+    def next(self, node_id: str, answer) -> str:
+        """
+        The id of the node after answering `answer` at `node_id`, or None
+        if that was the last question.
+        """
+        node = self.nodes[node_id]
+        if node.multi:
+            return node.exit
+        return node.successors.get(answer, node.exit)
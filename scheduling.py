@@ -0,0 +1,195 @@
+"""
+Item assignment with expiring leases.
+
+A worker who is handed an item holds a lease on it until they confirm it or the
+lease runs out. An item is only handed out while its completed plus leased
+count is below the target, so workers arriving at the same time cannot all be
+given the same under-annotated items. Leases of abandoned sessions expire and
+the items become available again.
+
+New sessions are filled least-covered-first: catalog items sit in a heap keyed
+on their coverage (completed plus leased), with a random tie-break, so every
+assignment takes the items that are furthest from the target. Heap entries are
+updated lazily: an entry whose coverage is out of date (because of a new lease,
+an expired one, or a completion made by another process) is re-pushed with the
+current value when it reaches the top.
+
+Leases live in memory and are shared by all Streamlit sessions of the process,
+which is how the apps are deployed. A worker who comes back after their leases
+expired still has the items in their session, so the apps `hold` every item
+before showing it: the worker keeps a live lease, gets a new one if the item
+is still below the target, and otherwise skips it.
+"""
+
+import heapq
+import random
+import threading
+from collections import defaultdict
+from time import time
+
+LEASE_SECONDS = 45 * 60  # how long an assigned but unconfirmed item stays reserved
+
+
+class NoItemsAvailable(Exception):
+    """
+    Every item of the catalog has reached its target.
+    """
+
+
+class LeaseScheduler:
+    def __init__(
+        self,
+        index,
+        target: int,
+        catalog: list = (),
+        lease_seconds: float = LEASE_SECONDS,
+    ):
+        """
+        `index` is a completion.CompletionIndex, `target` the number of
+        annotations wanted per item and `catalog` the items `allocate` draws
+        from.
+        """
+        self.index = index
+        self.target = target
+        self.lease_seconds = lease_seconds
+        self._items = {str(item): item for item in catalog}
+        self._leases = defaultdict(dict)  # item -> {worker_id: expiry}
+        self._expiries = []  # heap of (expiry, item, worker_id)
+        self._coverage = {}  # item -> coverage of its live heap entry
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+        self._heap = []  # heap of (coverage, tie-break, item)
+        counts = index.counts()  # one read for the whole catalog
+        for key in self._items:
+            coverage = counts.get(key, 0)
+            if coverage < self.target:
+                self._coverage[key] = coverage
+                self._heap.append((coverage, self._random.random(), key))
+        heapq.heapify(self._heap)
+
+    def _current_coverage(self, item: str) -> int:
+        return self.index.count(item) + len(self._leases.get(item, ()))
+
+    def _update(self, item: str):
+        """
+        Push a fresh heap entry if the coverage of `item` changed.
+        """
+        if item not in self._items:
+            return
+        coverage = self._current_coverage(item)
+        if coverage >= self.target:
+            self._coverage.pop(item, None)
+        elif self._coverage.get(item) != coverage:
+            self._coverage[item] = coverage
+            heapq.heappush(self._heap, (coverage, self._random.random(), item))
+
+    def _reclaim(self, now: float):
+        while self._expiries and self._expiries[0][0] <= now:
+            expiry, item, worker_id = heapq.heappop(self._expiries)
+            holders = self._leases.get(item)
+            if holders and holders.get(worker_id) == expiry:
+                del holders[worker_id]
+                if not holders:
+                    del self._leases[item]
+                self._update(item)
+
+    def _lease(self, item: str, worker_id: str, now: float):
+        expiry = now + self.lease_seconds
+        self._leases[item][worker_id] = expiry
+        heapq.heappush(self._expiries, (expiry, item, worker_id))
+        self._update(item)
+
+    def _has_capacity(self, item: str) -> bool:
+        return self._current_coverage(item) < self.target
+
+    def hold(self, worker_id: str, item) -> bool:
+        """
+        Whether `worker_id` may annotate `item` now: they hold a live lease on
+        it, or it is below the target and they get a new one. Items outside
+        the catalog (e.g. qualification items) have no target.
+        """
+        with self._lock:
+            now = time()
+            self._reclaim(now)
+            key = str(item)
+            if key not in self._items or worker_id in self._leases.get(key, ()):
+                return True
+            if not self._has_capacity(key):
+                return False
+            self._lease(key, worker_id, now)
+            return True
+
+    def allocate(self, worker_id: str, k: int) -> list:
+        """
+        Lease the `k` least-covered catalog items to `worker_id` and return
+        them, skipping items the worker already holds.
+        """
+        reserved = []
+        held = []
+        with self._lock:
+            now = time()
+            self._reclaim(now)
+            while self._heap and len(reserved) < k:
+                coverage, _, item = heapq.heappop(self._heap)
+                if self._coverage.get(item) != coverage:
+                    continue  # superseded by a newer entry
+                del self._coverage[item]
+                if self._current_coverage(item) != coverage:
+                    self._update(item)
+                    continue
+                if worker_id in self._leases.get(item, ()):
+                    held.append(item)
+                    continue
+                self._lease(item, worker_id, now)
+                reserved.append(self._items[item])
+            for item in held:
+                self._update(item)
+        return reserved
+
+    def reserve(self, worker_id: str, candidates: list, k: int) -> list:
+        """
+        Lease up to `k` of `candidates`, in order, to `worker_id` and return
+        them. Items the worker already holds are kept; items without spare
+        capacity are skipped.
+        """
+        reserved = []
+        with self._lock:
+            now = time()
+            self._reclaim(now)
+            for item in candidates:
+                if len(reserved) >= k:
+                    break
+                key = str(item)
+                if worker_id in self._leases.get(key, ()) or self._has_capacity(key):
+                    self._lease(key, worker_id, now)
+                    reserved.append(item)
+        return reserved
+
+    def renew(self, worker_id: str, items: list):
+        """
+        Extend the worker's leases on those of `items` they still hold. Called
+        on every rerun, so only sessions that are gone let their leases expire.
+        """
+        with self._lock:
+            now = time()
+            self._reclaim(now)
+            for item in items:
+                key = str(item)
+                expiry = self._leases.get(key, {}).get(worker_id)
+                # skip fresh leases so reruns don't flood the expiry heap
+                if expiry is not None and expiry - now < self.lease_seconds / 2:
+                    self._lease(key, worker_id, now)
+
+    def release(self, worker_id: str, item):
+        """
+        Drop a lease, e.g. once the item has been recorded as completed.
+        """
+        with self._lock:
+            key = str(item)
+            holders = self._leases.get(key)
+            if holders and worker_id in holders:
+                del holders[worker_id]
+                if not holders:
+                    del self._leases[key]
+            self._update(key)
@@ -0,0 +1,204 @@
+"""
+Worker sessions.
+
+What the apps keep about their workers, behind one `Sessions` per app: the
+items of every worker's session and their answers, the checkpoints of the
+items being answered, how many workers have done each item (completion.py)
+and the leases on the items being worked on (scheduling.py).
+
+The state lives either in the bucket or in a state_store.StateStore. In the
+bucket, every write goes through the write-behind queue (write_behind.py), so
+saving an answer doesn't wait for the bucket, and every read sees the writes
+still queued. The store is always current, and saves an answer, its
+completion and the removal of its checkpoint in one transaction.
+
+Every app makes its `Sessions` once, with its own folders and targets, and
+caches it with st.cache_resource; what is shown on the page stays in the
+apps.
+"""
+
+from urllib.parse import quote
+
+import pandas as pd
+
+import completion
+import progress_log
+import scheduling
+import state_store
+import write_behind
+
+
+def record_consent(
+    fs,
+    store: state_store.StateStore,
+    non_participants_folder: str,
+    worker_id: str,
+    consent: str,
+):
+    """
+    Record whether a worker consented: in the state store if there is one,
+    else only those who didn't, as one object per worker in the bucket so
+    recording a choice never reads the others.
+    """
+    if store is not None:
+        store.record_consent(worker_id, consent)
+    elif consent == "No":
+        path = f"{non_participants_folder}{quote(worker_id, safe='')}.txt"
+        with fs.open(path, "w") as f:
+            f.write(f"{worker_id}\n")
+
+
+class Sessions:
+    """
+    The sessions of the workers of one app. `fs` is the app's
+    io_accounting.AccountingStorage and `store` its state store, or None to
+    keep the state in the bucket. `catalog` lists the items to schedule, the
+    ones that need `annotators_per_item` workers.
+    """
+
+    def __init__(
+        self,
+        fs,
+        write_queue: write_behind.WriteBehindQueue,
+        store: state_store.StateStore,
+        id_col: str,
+        progress_folder: str,
+        done_file: str,
+        annotators_per_item: int,
+        catalog: list,
+    ):
+        self.fs = fs.wrap(write_behind.DeferredFileSystem(write_queue))
+        self.store = store
+        self.id_col = id_col
+        self.progress_folder = progress_folder
+        if store is not None:
+            self.index = state_store.StoreCompletionIndex(store, annotators_per_item)
+        else:
+            self.index = completion.CompletionIndex(
+                self.fs, done_file, annotators_per_item
+            )
+        self.index.refresh()
+        self.scheduler = scheduling.LeaseScheduler(
+            self.index, annotators_per_item, catalog=catalog
+        )
+
+    def progress_file(self, worker_id: str) -> str:
+        return f"{self.progress_folder}/progress_{worker_id}.csv"
+
+    def load_progress(self, worker_id: str) -> pd.DataFrame:
+        """
+        Load the saved progress of a worker, or None if they have none.
+        """
+        if self.store is not None:
+            return self.store.load_session(worker_id, self.id_col)
+        progress_file = self.progress_file(worker_id)
+        if not self.fs.exists(progress_file):
+            return None
+        return progress_log.load_progress(self.fs, progress_file, self.id_col)
+
+    def save_progress(self, worker_id: str, progress: pd.DataFrame):
+        if self.store is not None:
+            self.store.create_session(worker_id, progress, self.id_col)
+            return
+        with self.fs.open(self.progress_file(worker_id), "w") as f:
+            f.write(progress.to_csv(index=False))
+
+    def save_answer(self, worker_id: str, item, seq: int, values: dict):
+        """
+        Save the answer to one item, record the item as completed and give up
+        its lease.
+        """
+        if self.store is not None:
+            self.store.save_answer(worker_id, item, values)
+        else:
+            progress_log.append_record(
+                self.fs,
+                self.progress_file(worker_id),
+                seq=seq,
+                item=item,
+                values=values,
+            )
+            self.index.record(item, worker_id)
+        self.scheduler.release(worker_id, item)
+
+    def save_checkpoint(self, worker_id: str, item, checkpoint: dict):
+        """
+        Save the answers given so far to `item`, replacing the previous ones.
+        """
+        if self.store is not None:
+            self.store.save_checkpoint(worker_id, item, checkpoint)
+            return
+        progress_log.save_checkpoint(
+            self.fs, self.progress_file(worker_id), item, checkpoint
+        )
+
+    def load_checkpoint(self, worker_id: str, item) -> dict:
+        if self.store is not None:
+            return self.store.load_checkpoint(worker_id, item)
+        return progress_log.load_checkpoint(
+            self.fs, self.progress_file(worker_id), item
+        )
+
+    def drop_checkpoint(self, worker_id: str, item):
+        """
+        Delete the checkpoint of an answered item, like the state store does in
+        the transaction saving the answer.
+        """
+        if self.store is None:
+            progress_log.drop_checkpoint(self.fs, self.progress_file(worker_id), item)
+
+    def start(
+        self, worker_id: str, notes: pd.DataFrame, size: int, qualifications=False
+    ) -> pd.DataFrame:
+        """
+        The session of a worker: the one they saved, with its leases taken
+        again (e.g. after a restart), or a new one of `size` items. With
+        `qualifications`, the notes marked as qualification items are added
+        to every new session; they aren't scheduled.
+        """
+        progress = self.load_progress(worker_id)
+        if progress is not None:
+            pending = progress.index[progress["done"].isnull()]
+            if qualifications:
+                pending = pending[~pending.isin(notes.index[notes["qualification"]])]
+            self.scheduler.reserve(worker_id, pending.tolist(), len(pending))
+            return progress
+
+        self.index.refresh()
+        ids_to_label = self.scheduler.allocate(worker_id, size)
+        if not ids_to_label:
+            # raised, so a cached caller tries again once there are items
+            raise scheduling.NoItemsAvailable()
+        notes_to_label = notes.loc[ids_to_label]
+        if qualifications:
+            # every worker gets every qualification item, they have no target
+            seed = hash(worker_id) % (2**31)
+            notes_to_label = pd.concat(
+                [notes[notes["qualification"]], notes_to_label]
+            ).sample(frac=1, random_state=seed)
+
+        ids_to_label = notes_to_label.index.tolist()
+        progress = pd.DataFrame(
+            {
+                self.id_col: ids_to_label,
+                "worker_id": [worker_id] * len(ids_to_label),
+                "done": [None] * len(ids_to_label),
+                "label": [None] * len(ids_to_label),
+                "image_name": notes_to_label["image_name"].tolist(),
+            }
+        )
+        progress.set_index(self.id_col, inplace=True, drop=False)
+        self.save_progress(worker_id, progress)
+        return progress
+
+    def next_item(self, worker_id: str, progress: pd.DataFrame):
+        """
+        The first item the worker hasn't done and may still annotate. Items that
+        reached their target while the worker's lease had lapsed are dropped
+        from `progress`, see scheduling.LeaseScheduler.hold.
+        """
+        for item in progress.index[progress["done"].isnull()]:
+            if self.scheduler.hold(worker_id, item):
+                return item
+            progress.drop(index=item, inplace=True)
+        return None
@@ -0,0 +1,279 @@
+"""
+Transactional state store on SQLite.
+
+Keeps the mutable state of a task (worker sessions with their answers,
+checkpoints of the items being answered, completions and consent outcomes) in
+one WAL-mode database instead of loose CSV and text objects, so resuming a
+session and counting completions are single indexed queries. Every thread gets
+its own connection; WAL lets the many Streamlit sessions of the process read
+while one writes.
+
+Item ids are stored as text in every table, and a loaded session has them
+back as numbers when they all are, as the progress CSV of the bucket backend
+does.
+
+`StoreCompletionIndex` gives the store the interface of
+completion.CompletionIndex so the scheduler can run on either.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from time import time
+
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    worker_id TEXT NOT NULL,
+    tweet_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    image_name TEXT,
+    done INTEGER,
+    label TEXT,
+    updated REAL,
+    PRIMARY KEY (worker_id, tweet_id)
+);
+CREATE INDEX IF NOT EXISTS sessions_tweet_id ON sessions (tweet_id);
+
+CREATE TABLE IF NOT EXISTS checkpoints (
+    worker_id TEXT NOT NULL,
+    tweet_id TEXT NOT NULL,
+    checkpoint TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (worker_id, tweet_id)
+);
+
+CREATE TABLE IF NOT EXISTS completions (
+    tweet_id TEXT NOT NULL,
+    worker_id TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (tweet_id, worker_id)
+);
+CREATE INDEX IF NOT EXISTS completions_worker_id ON completions (worker_id);
+
+CREATE TABLE IF NOT EXISTS completion_counts (
+    tweet_id TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS completion_counts_count ON completion_counts (count);
+
+CREATE TRIGGER IF NOT EXISTS completions_count AFTER INSERT ON completions
+BEGIN
+    INSERT INTO completion_counts (tweet_id, count) VALUES (NEW.tweet_id, 1)
+    ON CONFLICT (tweet_id) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TABLE IF NOT EXISTS consent (
+    worker_id TEXT PRIMARY KEY,
+    consent TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+
+def _parse_ids(ids: pd.Series) -> pd.Series:
+    # like read_csv, which is how the bucket backend loads a session
+    try:
+        return pd.to_numeric(ids)
+    except ValueError:
+        return ids
+
+
+class StateStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self, statements: list):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in statements:
+                connection.execute(sql, params)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    # sessions
+
+    def create_session(self, worker_id: str, progress: pd.DataFrame, id_col: str):
+        now = time()
+        self._transaction(
+            [
+                (
+                    "INSERT OR IGNORE INTO sessions"
+                    " (worker_id, tweet_id, position, image_name, updated)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (
+                        worker_id,
+                        str(row[id_col]),
+                        position,
+                        row["image_name"],
+                        now,
+                    ),
+                )
+                for position, row in enumerate(progress.to_dict("records"))
+            ]
+        )
+
+    def load_session(self, worker_id: str, id_col: str) -> pd.DataFrame:
+        """
+        The worker's progress in the apps' format, or None if they have none.
+        """
+        rows = (
+            self._connection()
+            .execute(
+                "SELECT tweet_id, worker_id, done, label, image_name FROM sessions"
+                " WHERE worker_id = ? ORDER BY position",
+                (worker_id,),
+            )
+            .fetchall()
+        )
+        if not rows:
+            return None
+        progress = pd.DataFrame(
+            rows, columns=[id_col, "worker_id", "done", "label", "image_name"]
+        )
+        progress[id_col] = _parse_ids(progress[id_col])
+        progress["done"] = (
+            progress["done"]
+            .map(lambda done: True if done == 1 else None)
+            .astype(object)
+        )
+        progress.set_index(id_col, inplace=True, drop=False)
+        return progress
+
+    def save_answer(self, worker_id: str, item, values: dict):
+        """
+        Store the answer to one item and count it as completed, atomically.
+        The item's checkpoint goes with it.
+        """
+        now = time()
+        self._transaction(
+            [
+                (
+                    "UPDATE sessions SET done = ?, label = ?, updated = ?"
+                    " WHERE worker_id = ? AND tweet_id = ?",
+                    (
+                        1 if values.get("done") else None,
+                        values.get("label"),
+                        now,
+                        worker_id,
+                        str(item),
+                    ),
+                ),
+                (
+                    "INSERT OR IGNORE INTO completions (tweet_id, worker_id, created)"
+                    " VALUES (?, ?, ?)",
+                    (str(item), worker_id, now),
+                ),
+                (
+                    "DELETE FROM checkpoints WHERE worker_id = ? AND tweet_id = ?",
+                    (worker_id, str(item)),
+                ),
+            ]
+        )
+
+    def save_checkpoint(self, worker_id: str, item, checkpoint: dict):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO checkpoints"
+            " (worker_id, tweet_id, checkpoint, updated) VALUES (?, ?, ?, ?)",
+            (worker_id, str(item), json.dumps(checkpoint), time()),
+        )
+
+    def load_checkpoint(self, worker_id: str, item) -> dict:
+        """
+        The last checkpoint saved for the worker's `item`, or None.
+        """
+        row = (
+            self._connection()
+            .execute(
+                "SELECT checkpoint FROM checkpoints"
+                " WHERE worker_id = ? AND tweet_id = ?",
+                (worker_id, str(item)),
+            )
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    # completions
+
+    def record_completion(self, item, worker_id: str):
+        self._connection().execute(
+            "INSERT OR IGNORE INTO completions (tweet_id, worker_id, created)"
+            " VALUES (?, ?, ?)",
+            (str(item), worker_id, time()),
+        )
+
+    def completion_count(self, item) -> int:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT count FROM completion_counts WHERE tweet_id = ?", (str(item),)
+            )
+            .fetchone()
+        )
+        return row[0] if row else 0
+
+    def completion_counts(self) -> dict:
+        rows = self._connection().execute(
+            "SELECT tweet_id, count FROM completion_counts"
+        )
+        return dict(rows.fetchall())
+
+    def complete_items(self, threshold: int) -> frozenset:
+        rows = self._connection().execute(
+            "SELECT tweet_id FROM completion_counts WHERE count >= ?", (threshold,)
+        )
+        return frozenset(tweet_id for (tweet_id,) in rows)
+
+    # consent
+
+    def record_consent(self, worker_id: str, consent: str):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO consent (worker_id, consent, created)"
+            " VALUES (?, ?, ?)",
+            (worker_id, consent, time()),
+        )
+
+
+class StoreCompletionIndex:
+    """
+    completion.CompletionIndex interface on top of a StateStore.
+    """
+
+    def __init__(self, store: StateStore, threshold: int):
+        self.store = store
+        self.threshold = threshold
+
+    def refresh(self, force: bool = False):
+        pass  # the store is always current
+
+    def record(self, item, worker_id: str):
+        self.store.record_completion(item, worker_id)
+
+    def count(self, item) -> int:
+        return self.store.completion_count(item)
+
+    def counts(self) -> dict:
+        return self.store.completion_counts()
+
+    def is_complete(self, item) -> bool:
+        return self.count(item) >= self.threshold
+
+    def complete_items(self) -> frozenset:
+        return self.store.complete_items(self.threshold)
@@ -0,0 +1,259 @@
+"""
+Storage backends for the annotation apps.
+
+Everything the apps persist or read (notes, images, the question tree,
+progress, done records and non-participants) lives at a path under the
+`annotation-experiment` bucket. A backend maps those paths to a place to keep
+them and offers the small file system API the apps use: `open`, `exists`,
+`glob`, `rm` and `info`.
+
+- `GCSStorage` talks to the bucket through the Streamlit files connection.
+- `LocalStorage` keeps the objects in a directory with the repo layout, so
+  `annotation-experiment/data/...` is `data/...` and
+  `annotation-experiment/static/...` is `static/...`.
+- `SQLiteStorage` keeps the objects as rows of a single SQLite table.
+
+The backend is picked with the ANNOTATION_STORAGE environment variable (`gcs`,
+`local` or `sqlite`); ANNOTATION_STORAGE_PATH sets the directory of the local
+backend or the database file of the SQLite one.
+"""
+
+import functools
+import glob
+import io
+import os
+import sqlite3
+import threading
+from fnmatch import fnmatch
+from time import time
+
+BUCKET = "annotation-experiment"
+REQUEST_TIMEOUT = 20  # seconds an HTTP request to GCS may take
+DEFAULT_LOCATIONS = {"local": ".", "sqlite": "data/storage.sqlite"}
+
+
+class Storage:
+    name = None
+
+    def open(self, path: str, mode: str = "r"):
+        raise NotImplementedError
+
+    def exists(self, path: str) -> bool:
+        raise NotImplementedError
+
+    def glob(self, pattern: str) -> list:
+        raise NotImplementedError
+
+    def rm(self, paths):
+        raise NotImplementedError
+
+    def info(self, path: str) -> dict:
+        raise NotImplementedError
+
+
+class GCSStorage(Storage):
+    name = "gcs"
+
+    def __init__(self, fs):
+        self.fs = fs
+
+    def open(self, path: str, mode: str = "r"):
+        return self.fs.open(path, mode)
+
+    def exists(self, path: str) -> bool:
+        return self.fs.exists(path)
+
+    def glob(self, pattern: str) -> list:
+        return self.fs.glob(pattern)
+
+    def rm(self, paths):
+        self.fs.rm(paths)
+
+    def info(self, path: str) -> dict:
+        return self.fs.info(path)
+
+    def __getattr__(self, name):
+        return getattr(self.fs, name)
+
+
+class LocalStorage(Storage):
+    name = "local"
+
+    def __init__(self, root: str = ".", bucket: str = BUCKET):
+        self.root = root
+        self.bucket = bucket
+
+    def _local(self, path: str) -> str:
+        path = path.removeprefix(f"{self.bucket}/")
+        return os.path.join(self.root, path)
+
+    def _remote(self, local: str) -> str:
+        path = os.path.relpath(local, self.root).replace(os.sep, "/")
+        return f"{self.bucket}/{path}"
+
+    def open(self, path: str, mode: str = "r"):
+        local = self._local(path)
+        if "w" in mode or "a" in mode:
+            os.makedirs(os.path.dirname(local) or ".", exist_ok=True)
+        return open(local, mode)
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(self._local(path))
+
+    def glob(self, pattern: str) -> list:
+        return sorted(self._remote(p) for p in glob.glob(self._local(pattern)))
+
+    def rm(self, paths):
+        if isinstance(paths, str):
+            paths = [paths]
+        for path in paths:
+            os.remove(self._local(path))
+
+    def info(self, path: str) -> dict:
+        stat = os.stat(self._local(path))
+        return {"name": path, "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+class _SQLiteFile(io.BytesIO):
+    def __init__(self, storage, path: str, text: bool):
+        super().__init__()
+        self._storage = storage
+        self._path = path
+        self._text = text
+
+    def write(self, data):
+        if self._text:
+            data = data.encode("utf-8")
+        return super().write(data)
+
+    def close(self):
+        if not self.closed:
+            self._storage._put(self._path, self.getvalue())
+        super().close()
+
+
+class SQLiteStorage(Storage):
+    name = "sqlite"
+
+    def __init__(self, path: str = DEFAULT_LOCATIONS["sqlite"]):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS objects ("
+            " path TEXT PRIMARY KEY, data BLOB NOT NULL, mtime REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _put(self, path: str, data: bytes):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO objects (path, data, mtime) VALUES (?, ?, ?)",
+            (path, data, time()),
+        )
+
+    def _get(self, path: str) -> bytes:
+        row = (
+            self._connection()
+            .execute("SELECT data FROM objects WHERE path = ?", (path,))
+            .fetchone()
+        )
+        if row is None:
+            raise FileNotFoundError(path)
+        return row[0]
+
+    def open(self, path: str, mode: str = "r"):
+        if "w" in mode:
+            return _SQLiteFile(self, path, text="b" not in mode)
+        data = self._get(path)
+        if "b" in mode:
+            return io.BytesIO(data)
+        return io.StringIO(data.decode("utf-8"))
+
+    def exists(self, path: str) -> bool:
+        row = (
+            self._connection()
+            .execute("SELECT 1 FROM objects WHERE path = ?", (path,))
+            .fetchone()
+        )
+        return row is not None
+
+    def glob(self, pattern: str) -> list:
+        # range scan on the literal prefix, then match like a path glob
+        prefix = pattern
+        for i, c in enumerate(pattern):
+            if c in "*?[":
+                prefix = pattern[:i]
+                break
+        depth = pattern.count("/")
+        rows = self._connection().execute(
+            "SELECT path FROM objects WHERE path >= ? AND path < ? ORDER BY path",
+            (prefix, prefix + "\uffff"),
+        )
+        return [
+            path
+            for (path,) in rows
+            if path.count("/") == depth and fnmatch(path, pattern)
+        ]
+
+    def rm(self, paths):
+        if isinstance(paths, str):
+            paths = [paths]
+        self._connection().executemany(
+            "DELETE FROM objects WHERE path = ?", [(path,) for path in paths]
+        )
+
+    def info(self, path: str) -> dict:
+        row = (
+            self._connection()
+            .execute("SELECT length(data), mtime FROM objects WHERE path = ?", (path,))
+            .fetchone()
+        )
+        if row is None:
+            raise FileNotFoundError(path)
+        return {"name": path, "size": row[0], "mtime": row[1]}
+
+
+def copy_objects(source: Storage, target: Storage, pattern: str) -> int:
+    """
+    Copy every object matching `pattern` from `source` to `target`, e.g. to
+    seed a local or SQLite backend from the bucket.
+    """
+    paths = source.glob(pattern)
+    for path in paths:
+        data = source.open(path, "rb").read()
+        with target.open(path, "wb") as f:
+            f.write(data)
+    return len(paths)
+
+
+@functools.lru_cache(maxsize=None)
+def open_storage(backend: str, location: str = None) -> Storage:
+    if backend == "gcs":
+        import streamlit as st
+        from st_files_connection import FilesConnection
+
+        connection = st.connection(
+            "gcs", type=FilesConnection, requests_timeout=REQUEST_TIMEOUT
+        )
+        return GCSStorage(connection.fs)
+    location = location or DEFAULT_LOCATIONS.get(backend)
+    if backend == "local":
+        return LocalStorage(location)
+    if backend == "sqlite":
+        return SQLiteStorage(location)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def from_config() -> Storage:
+    return open_storage(
+        os.environ.get("ANNOTATION_STORAGE", "gcs"),
+        os.environ.get("ANNOTATION_STORAGE_PATH"),
+    )
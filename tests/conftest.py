@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+# the modules of the apps live at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import storage
+import write_behind
+
+
+class FlakyStorage(storage.LocalStorage):
+    """
+    A local bucket whose writes can be made to fail, like an unreachable GCS.
+    """
+
+    failing = False
+
+    def open(self, path: str, mode: str = "r"):
+        if self.failing and ("w" in mode or "a" in mode):
+            raise OSError("bucket unavailable")
+        return super().open(path, mode)
+
+
+@pytest.fixture
+def bucket(tmp_path) -> FlakyStorage:
+    return FlakyStorage(str(tmp_path / "bucket"))
+
+
+@pytest.fixture
+def queue(bucket, tmp_path):
+    queue = write_behind.WriteBehindQueue(bucket, spool_folder=str(tmp_path / "spool"))
+    yield queue
+    bucket.failing = False
+    queue.close()
@@ -0,0 +1,40 @@
+import catalog
+
+CSV = "data/notes.csv"
+CATALOG = "data/notes"
+
+
+def write_csv(fs, text: str):
+    with fs.open(CSV, "w") as f:
+        f.write(text)
+
+
+def test_notes_without_a_language_are_kept(bucket):
+    write_csv(
+        bucket,
+        "tweet_id,image_name,language_present\n1,a.png,en\n2,b.png,\n3,c.png,de\n",
+    )
+    rows = catalog.convert(bucket, CSV, CATALOG)
+    assert rows == {"en": 1, "de": 1, catalog.MISSING_LANGUAGE: 1}
+    notes = catalog.read_notes(
+        bucket,
+        CATALOG,
+        CSV,
+        catalog.MISSING_LANGUAGE,
+        ["tweet_id", "image_name"],
+        {"b.png"},
+    )
+    assert notes.to_dict("records") == [{"tweet_id": 2, "image_name": "b.png"}]
+
+
+def test_a_column_empty_in_the_first_chunk_is_written(bucket):
+    write_csv(
+        bucket,
+        "tweet_id,image_name,note,language_present\n"
+        "1,a.png,,en\n2,b.png,,en\n3,c.png,some text,en\n",
+    )
+    assert catalog.convert(bucket, CSV, CATALOG, chunksize=2) == {"en": 3}
+    notes = catalog.read_notes(
+        bucket, CATALOG, CSV, "en", ["image_name", "note"], {"a.png", "c.png"}
+    )
+    assert notes["note"].isna().tolist() == [True, False]
@@ -0,0 +1,70 @@
+import completion
+import write_behind
+
+DONE_FILE = "annotation-experiment/data/done.txt"
+
+
+def record(fs, n: int, worker_id: str = "w"):
+    for item in range(n):
+        completion.record_completion(fs, DONE_FILE, item, worker_id)
+
+
+def test_compact_folds_the_shards_into_the_snapshot(bucket):
+    record(bucket, 5)
+    completion.compact(bucket, DONE_FILE)
+    assert completion.list_shards(bucket, DONE_FILE) == []
+    assert len(completion.read_snapshot(bucket, DONE_FILE)) == 5
+
+
+def test_compacting_the_same_shards_twice_counts_them_once(bucket):
+    record(bucket, 3)
+    completion.compact(bucket, DONE_FILE)
+    record(bucket, 3)  # e.g. uploaded again after a retry
+    completion.compact(bucket, DONE_FILE)
+    index = completion.CompletionIndex(bucket, DONE_FILE, threshold=1)
+    index.refresh()
+    assert [index.count(item) for item in range(3)] == [1, 1, 1]
+
+
+def test_compact_keeps_the_shards_while_the_snapshot_cant_be_uploaded(bucket, queue):
+    record(bucket, 5)
+    fs = write_behind.DeferredFileSystem(queue)
+    bucket.failing = True
+    completion.compact(fs, DONE_FILE)
+    # the bucket still holds every completion, as shards
+    assert len(completion.list_shards(bucket, DONE_FILE)) == 5
+
+    bucket.failing = False
+    completion.compact(fs, DONE_FILE)
+    assert completion.list_shards(bucket, DONE_FILE) == []
+    assert len(completion.read_snapshot(bucket, DONE_FILE)) == 5
+
+
+def test_compact_uploads_the_snapshot_before_deleting_the_shards(bucket, queue):
+    record(bucket, 5)
+    fs = write_behind.DeferredFileSystem(queue)
+    deleted = []
+
+    def rm(paths):
+        # the snapshot is in the bucket, not only in the spool, by now
+        assert len(completion.read_snapshot(bucket, DONE_FILE)) == 5
+        deleted.extend(paths)
+        type(bucket).rm(bucket, paths)
+
+    bucket.rm = rm
+    completion.compact(fs, DONE_FILE)
+    assert len(deleted) == 5
+
+
+def test_index_counts_survive_compaction(bucket):
+    index = completion.CompletionIndex(
+        bucket, DONE_FILE, threshold=2, refresh_interval=0, compact_after=3
+    )
+    record(bucket, 2, "a")
+    record(bucket, 2, "b")
+    index.refresh()  # 4 shards, compacted
+    assert completion.list_shards(bucket, DONE_FILE) == []
+    index.record(2, "a")
+    index.refresh()
+    assert [index.count(item) for item in range(3)] == [2, 2, 1]
+    assert index.complete_items() == {"0", "1"}
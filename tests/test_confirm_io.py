@@ -0,0 +1,62 @@
+import os
+import sys
+
+import pytest
+import streamlit as st
+
+import io_accounting
+import storage
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import harness  # noqa: E402
+
+
+def answer(app: dict, name: str):
+    """
+    Give an answer to the current item the way the app's widgets would.
+    """
+    if name == "app.py":
+        st.session_state[app["POSITIVE_EMOTIONS"][0]] = True
+    elif name == "app_visual_evidence.py":
+        label = app["LABELS"][0]
+        st.session_state[label] = app["QUESTION_OPTIONS"][label][0]
+    else:
+        st.session_state.labels = [("A question", "An answer", "")]
+
+
+@pytest.mark.parametrize(
+    "name", ["app.py", "app_visual_evidence.py", "app_visual_evidence_flow.py"]
+)
+def test_a_confirm_stays_within_its_io_budget(name, tmp_path, monkeypatch):
+    root = str(tmp_path / "bucket")
+    harness.make_bucket(root, 20, emotions=True)
+    monkeypatch.setenv("ANNOTATION_STORAGE", "local")
+    monkeypatch.setenv("ANNOTATION_STORAGE_PATH", root)
+    monkeypatch.chdir(tmp_path)  # the write spool and the metrics log
+    st.cache_resource.clear()
+    st.session_state.clear()
+
+    fs = io_accounting.AccountingStorage(storage.LocalStorage(root))
+    app = harness.load_app(os.path.join(ROOT, name), fs, {"DEBUGGING": False})
+    try:
+        notes = app["load_notes"]()
+        app["load_sessions"]()
+        if "load_question_tree" in app:
+            app["load_question_tree"]()  # loaded by the page before any confirm
+        st.session_state.worker_id = "w"
+        st.session_state.progress = app["get_worker_session"]("w", notes)
+        note = notes.loc[
+            app["select_next_item_for_worker_id"](st.session_state.progress)
+        ]
+        answer(app, name)
+
+        with fs.accounting.budget(**app["CONFIRM_IO_BUDGET"]) as confirm_io:
+            app["confirm_label"](note)
+        assert confirm_io["writes"] > 0
+        assert st.session_state.progress.at[note.name, "done"]
+    finally:
+        app["load_write_queue"]().close()
+        st.cache_resource.clear()
+        st.session_state.clear()
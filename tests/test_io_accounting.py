@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+import io_accounting
+
+
+@pytest.fixture
+def fs(bucket):
+    fs = io_accounting.AccountingStorage(bucket)
+    with fs.open("data/a.txt", "w") as f:
+        f.write("line 1\nline 2\n")
+    fs.accounting.reset()
+    return fs
+
+
+def test_calls_and_bytes_are_counted(fs):
+    assert fs.exists("data/a.txt")
+    assert len(fs.glob("data/*.txt")) == 1
+    fs.info("data/a.txt")
+    with fs.open("data/b.txt", "w") as f:
+        f.write("abc")
+    fs.rm(["data/b.txt"])
+    totals = fs.accounting.totals
+    for field in ("exists", "globs", "infos", "rms"):
+        assert totals[field] == 1
+    assert (totals["writes"], totals["bytes_written"]) == (1, 3)
+
+
+def test_only_reads_to_the_end_are_full_reads(fs):
+    with fs.open("data/a.txt") as f:
+        f.read(4)
+    assert fs.accounting.totals["full_reads"] == 0
+    with fs.open("data/a.txt") as f:
+        list(f)
+    with fs.open("data/a.txt") as f:
+        f.read()
+    totals = fs.accounting.totals
+    assert (totals["reads"], totals["full_reads"]) == (3, 2)
+    assert totals["bytes_read"] == 4 + 2 * len("line 1\nline 2\n")
+
+
+def test_budget_raises_when_a_count_is_over_its_limit(fs):
+    with fs.accounting.budget(writes=1, full_reads=0):
+        fs.write_now("data/c.txt", "c")
+    with pytest.raises(io_accounting.IOBudgetExceeded, match="1 full_reads"):
+        with fs.accounting.budget(writes=1, full_reads=0):
+            fs.open("data/a.txt").read()
+
+
+def test_nested_measures_both_count(fs):
+    with fs.accounting.measure() as outer:
+        fs.exists("data/a.txt")
+        with fs.accounting.measure() as inner:
+            fs.exists("data/a.txt")
+    assert (outer["exists"], inner["exists"]) == (2, 1)
+
+
+def test_reruns_count_towards_their_worker(fs):
+    counter = fs.accounting.begin_rerun("w1")
+    fs.exists("data/a.txt")
+    fs.accounting.begin_rerun("w2")
+    fs.exists("data/a.txt")
+    fs.exists("data/a.txt")
+    assert counter["exists"] == 1
+    workers = fs.accounting.workers
+    assert (workers["w1"]["exists"], workers["w2"]["exists"]) == (1, 2)
+
+
+def test_background_threads_only_count_towards_the_totals(fs):
+    counter = fs.accounting.begin_rerun("w")
+    thread = threading.Thread(target=fs.exists, args=["data/a.txt"])
+    thread.start()
+    thread.join()
+    assert counter["exists"] == 0
+    assert fs.accounting.workers == {}
+    assert fs.accounting.totals["exists"] == 1
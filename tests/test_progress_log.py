@@ -0,0 +1,53 @@
+import pandas as pd
+
+import progress_log
+import write_behind
+
+PROGRESS_FILE = "annotation-experiment/data/worker_progress/progress_w.csv"
+
+
+def start_session(fs, items: int):
+    progress = pd.DataFrame(
+        {"tweet_id": range(items), "done": [None] * items, "label": [None] * items}
+    )
+    with fs.open(PROGRESS_FILE, "w") as f:
+        f.write(progress.to_csv(index=False))
+    for item in range(items):
+        progress_log.append_record(
+            fs, PROGRESS_FILE, seq=item + 1, item=item, values={"done": True}
+        )
+
+
+def test_records_are_replayed_and_consolidated(bucket):
+    start_session(bucket, 3)
+    progress = progress_log.load_progress(
+        bucket, PROGRESS_FILE, "tweet_id", consolidate_after=3
+    )
+    assert progress["done"].tolist() == [True, True, True]
+    assert progress_log.list_records(bucket, PROGRESS_FILE) == []
+    progress = progress_log.load_progress(bucket, PROGRESS_FILE, "tweet_id")
+    assert progress["done"].tolist() == [True, True, True]
+
+
+def test_consolidate_keeps_the_records_while_the_csv_cant_be_uploaded(bucket, queue):
+    start_session(bucket, 3)
+    fs = write_behind.DeferredFileSystem(queue)
+    bucket.failing = True
+    progress_log.load_progress(fs, PROGRESS_FILE, "tweet_id", consolidate_after=3)
+    assert len(progress_log.list_records(bucket, PROGRESS_FILE)) == 3
+
+    bucket.failing = False
+    assert queue.flush(timeout=10)
+    progress = progress_log.load_progress(bucket, PROGRESS_FILE, "tweet_id")
+    assert progress["done"].tolist() == [True, True, True]
+
+
+def test_the_checkpoint_of_an_answered_item_is_dropped(bucket, queue):
+    fs = write_behind.DeferredFileSystem(queue)
+    progress_log.save_checkpoint(fs, PROGRESS_FILE, 7, {"cursor": "image"})
+    assert progress_log.load_checkpoint(fs, PROGRESS_FILE, 7) == {"cursor": "image"}
+    progress_log.drop_checkpoint(fs, PROGRESS_FILE, 7)
+    assert progress_log.load_checkpoint(fs, PROGRESS_FILE, 7) is None
+
+    assert queue.flush(timeout=10)
+    assert not bucket.exists(progress_log.checkpoint_path(PROGRESS_FILE, 7))
@@ -0,0 +1,94 @@
+import pytest
+
+import question_tree
+
+TREE = {
+    "image": {
+        "title": "About the image",
+        "question": "Is the image genuine?",
+        "explanation": "Select an answer",
+        "answers": {
+            "yes": {"label": "genuine"},
+            "no": {
+                "question": "What is wrong with it?",
+                "explanation": "Select an answer",
+                "mandatory_text": "required-Other",
+                "answers": {
+                    "edited": {"label": "edited"},
+                    "other": {
+                        "question": "Which of these?",
+                        "explanation": "Select all that apply",
+                        "multiple_answers": True,
+                        "answers": {
+                            "cropped": {
+                                "question": "Never asked",
+                                "explanation": "",
+                                "answers": {"a": {"label": "a"}},
+                            },
+                            "generated": {"label": "generated"},
+                        },
+                    },
+                },
+            },
+        },
+    },
+    "text_in_image": {
+        "question": "Is the text genuine?",
+        "explanation": "Select an answer",
+        "mandatory_text": "required-None",
+        "answers": {"yes": {"label": "genuine"}, "no": {"label": "fake"}},
+    },
+}
+
+
+@pytest.fixture
+def tree() -> question_tree.QuestionTree:
+    return question_tree.QuestionTree(TREE, max_depth=3)
+
+
+def test_nodes_are_named_after_the_answers_leading_to_them(tree):
+    assert sorted(tree.nodes) == [
+        "image",
+        "image/No",
+        "image/No/Other",
+        "text_in_image",
+    ]
+    node = tree.nodes["image/No"]
+    assert (node.depth, node.answers, node.mandatory_text) == (
+        1,
+        ["Other", "Edited"],
+        True,
+    )
+
+
+def test_explanations_are_only_mandatory_for_an_answer(tree):
+    assert tree.nodes["image/No"].mandatory_text
+    assert not tree.nodes["image"].mandatory_text  # no mandatory_text
+    assert not tree.nodes["text_in_image"].mandatory_text  # "required-None"
+
+
+def test_sections_are_titled(tree):
+    assert tree.nodes["image/No/Other"].title == "About the image"
+    assert tree.nodes["text_in_image"].title == "Text in image related questions"
+
+
+def test_next_walks_the_tree_section_by_section(tree):
+    node_id = tree.start()
+    for answer, expected in [
+        ("No", "image/No"),
+        ("Other", "image/No/Other"),
+        (["Cropped"], "text_in_image"),
+        ("Yes", None),
+    ]:
+        node_id = tree.next(node_id, answer)
+        assert node_id == expected
+
+
+def test_an_answer_leading_to_a_label_ends_the_section(tree):
+    assert tree.next("image", "Yes") == "text_in_image"
+    assert tree.next("image/No", "Edited") == "text_in_image"
+
+
+def test_a_tree_deeper_than_allowed_is_refused():
+    with pytest.raises(ValueError, match="3 deep"):
+        question_tree.QuestionTree(TREE, max_depth=2)
@@ -0,0 +1,124 @@
+from collections import Counter
+
+import pytest
+
+import scheduling
+import state_store
+
+
+class Index:
+    """
+    The part of completion.CompletionIndex the scheduler uses.
+    """
+
+    def __init__(self):
+        self.completed = Counter()
+
+    def count(self, item) -> int:
+        return self.completed[str(item)]
+
+    def counts(self) -> dict:
+        return dict(self.completed)
+
+
+def complete(index, scheduler, worker_id, items):
+    for item in items:
+        index.completed[str(item)] += 1
+        scheduler.release(worker_id, item)
+
+
+def test_allocate_stops_at_target():
+    index = Index()
+    scheduler = scheduling.LeaseScheduler(index, target=3, catalog=range(25))
+    for worker_id in "abc":
+        assert sorted(scheduler.allocate(worker_id, 25)) == list(range(25))
+    assert scheduler.allocate("d", 25) == []
+
+
+def test_allocate_prefers_least_covered():
+    index = Index()
+    index.completed.update({"0": 2, "1": 1})
+    scheduler = scheduling.LeaseScheduler(index, target=3, catalog=range(3))
+    assert scheduler.allocate("a", 1) == [2]
+    assert sorted(scheduler.allocate("b", 2)) == [1, 2]
+
+
+def test_allocate_skips_items_already_held():
+    scheduler = scheduling.LeaseScheduler(Index(), target=3, catalog=range(2))
+    assert sorted(scheduler.allocate("a", 2)) == [0, 1]
+    assert scheduler.allocate("a", 2) == []
+    assert sorted(scheduler.allocate("b", 2)) == [0, 1]
+
+
+def test_completed_items_stay_counted():
+    index = Index()
+    scheduler = scheduling.LeaseScheduler(index, target=1, catalog=range(2))
+    complete(index, scheduler, "a", scheduler.allocate("a", 1))
+    assert len(scheduler.allocate("b", 2)) == 1
+
+
+def test_expired_leases_are_reallocated(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(scheduling, "time", lambda: now[0])
+    scheduler = scheduling.LeaseScheduler(
+        Index(), target=1, catalog=range(2), lease_seconds=60
+    )
+    assert len(scheduler.allocate("a", 2)) == 2
+    assert scheduler.allocate("b", 2) == []
+    now[0] += 61
+    assert sorted(scheduler.allocate("b", 2)) == [0, 1]
+
+
+@pytest.mark.parametrize("expired", [False, True])
+def test_hold_never_goes_past_target(monkeypatch, expired):
+    now = [1000.0]
+    monkeypatch.setattr(scheduling, "time", lambda: now[0])
+    index = Index()
+    scheduler = scheduling.LeaseScheduler(
+        index, target=1, catalog=range(2), lease_seconds=60
+    )
+    scheduler.allocate("a", 2)
+    if expired:
+        # a leaves, b takes a's items over and completes one
+        now[0] += 61
+        assert sorted(scheduler.allocate("b", 2)) == [0, 1]
+        complete(index, scheduler, "b", [0])
+        assert not scheduler.hold("a", 0)  # done by b
+        assert not scheduler.hold("a", 1)  # leased to b
+    else:
+        assert scheduler.hold("a", 0)
+        assert scheduler.hold("a", 1)
+    assert not scheduler.hold("c", 0)
+
+
+def test_hold_takes_a_new_lease_while_below_target(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(scheduling, "time", lambda: now[0])
+    scheduler = scheduling.LeaseScheduler(
+        Index(), target=1, catalog=range(1), lease_seconds=60
+    )
+    scheduler.allocate("a", 1)
+    now[0] += 61
+    assert scheduler.hold("a", 0)
+    assert scheduler.allocate("b", 1) == []
+
+
+def test_hold_lets_items_outside_the_catalog_through():
+    scheduler = scheduling.LeaseScheduler(Index(), target=1, catalog=range(1))
+    scheduler.allocate("a", 1)
+    assert scheduler.hold("b", "qualification")
+
+
+def test_scheduler_on_the_state_store_reads_the_counts_in_one_query(tmp_path):
+    store = state_store.StateStore(str(tmp_path / "state.db"))
+    for worker_id in "ab":
+        store.record_completion(0, worker_id)
+    store.record_completion(1, "a")
+    index = state_store.StoreCompletionIndex(store, threshold=2)
+    assert index.counts() == {"0": 2, "1": 1}
+
+    queries = []
+    store._connection().set_trace_callback(queries.append)
+    scheduler = scheduling.LeaseScheduler(index, target=2, catalog=range(3))
+    assert len(queries) == 1
+    assert sorted(scheduler.allocate("c", 3)) == [1, 2]
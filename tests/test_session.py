@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+
+import io_accounting
+import session
+import state_store
+
+NOTES = pd.DataFrame(
+    {
+        "tweet_id": range(6),
+        "image_name": [f"{n}.jpeg" for n in range(6)],
+        "qualification": [False] * 4 + [True] * 2,
+    }
+).set_index("tweet_id", drop=False)
+
+
+@pytest.fixture(params=["bucket", "sqlite"])
+def sessions(request, bucket, queue, tmp_path):
+    store = None
+    if request.param == "sqlite":
+        store = state_store.StateStore(str(tmp_path / "state.db"))
+    return session.Sessions(
+        io_accounting.AccountingStorage(bucket),
+        queue,
+        store,
+        "tweet_id",
+        "data/progress",
+        "data/done.txt",
+        annotators_per_item=1,
+        catalog=list(range(4)),
+    )
+
+
+def test_a_session_is_resumed_with_its_answers(sessions):
+    progress = sessions.start("w", NOTES, 2, qualifications=True)
+    assert len(progress) == 4  # the two qualification items come on top
+    item = progress.index[~NOTES.loc[progress.index, "qualification"]][0]
+    sessions.save_checkpoint("w", item, {"cursor": "image"})
+    assert sessions.load_checkpoint("w", item) == {"cursor": "image"}
+    sessions.save_answer("w", item, seq=1, values={"done": True, "label": "x"})
+    sessions.drop_checkpoint("w", item)
+
+    resumed = sessions.load_progress("w")
+    assert resumed.index.tolist() == progress.index.tolist()
+    assert resumed.at[item, "label"] == "x"
+    assert sessions.load_checkpoint("w", item) is None
+    assert sessions.index.count(item) == 1
+
+
+def test_a_done_item_is_dropped_when_its_lease_lapsed(sessions):
+    progress = sessions.start("w", NOTES, 1)
+    item = progress.index[0]
+    sessions.scheduler.release("w", item)
+    sessions.save_answer("v", item, seq=1, values={"done": True, "label": "x"})
+    assert sessions.next_item("w", progress) is None
+    assert progress.empty
+
+
+def test_only_non_participants_are_recorded_in_the_bucket(bucket):
+    fs = io_accounting.AccountingStorage(bucket)
+    session.record_consent(fs, None, "data/non_participants/", "a/b", "No")
+    session.record_consent(fs, None, "data/non_participants/", "c", "Yes")
+    assert len(fs.glob("data/non_participants/*")) == 1
+    assert fs.exists("data/non_participants/a%2Fb.txt")
@@ -0,0 +1,20 @@
+import pandas as pd
+
+import state_store
+
+
+def test_a_session_comes_back_with_its_ids_and_answers(tmp_path):
+    store = state_store.StateStore(str(tmp_path / "state.db"))
+    progress = pd.DataFrame(
+        {"tweet_id": pd.Series([3, 1, 2], dtype="int64"), "image_name": "a.png"}
+    )
+    store.create_session("w", progress, "tweet_id")
+    store.save_checkpoint("w", progress["tweet_id"][0], {"cursor": "image"})
+    store.save_answer("w", progress["tweet_id"][0], {"done": True, "label": "x"})
+
+    session = store.load_session("w", "tweet_id")
+    assert session.index.tolist() == [3, 1, 2]
+    assert session["tweet_id"].dtype == "int64"
+    assert session["done"].tolist() == [True, None, None]
+    assert store.load_checkpoint("w", 3) is None
+    assert store.completion_counts() == {"3": 1}
@@ -0,0 +1,119 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+import write_behind
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def test_writes_are_served_back_until_uploaded(bucket, queue):
+    bucket.failing = True
+    fs = write_behind.DeferredFileSystem(queue)
+    with fs.open("annotation-experiment/data/a.txt", "w") as f:
+        f.write("a")
+    assert fs.exists("annotation-experiment/data/a.txt")
+    assert fs.open("annotation-experiment/data/a.txt").read() == "a"
+    assert not bucket.exists("annotation-experiment/data/a.txt")
+
+    bucket.failing = False
+    assert queue.flush(timeout=10)
+    assert bucket.open("annotation-experiment/data/a.txt").read() == "a"
+
+
+def test_writes_of_a_key_are_uploaded_in_order(bucket, queue):
+    fs = write_behind.DeferredFileSystem(queue)
+    for i in range(20):
+        with fs.open("annotation-experiment/data/a.txt", "w") as f:
+            f.write(str(i))
+    assert queue.flush(timeout=10)
+    assert bucket.open("annotation-experiment/data/a.txt").read() == "19"
+
+
+def test_rm_cancels_a_pending_write(bucket, queue):
+    bucket.failing = True
+    fs = write_behind.DeferredFileSystem(queue)
+    with fs.open("annotation-experiment/data/a.txt", "w") as f:
+        f.write("a")
+    fs.rm("annotation-experiment/data/a.txt")
+    bucket.failing = False
+    assert queue.flush(timeout=10)
+    assert not bucket.exists("annotation-experiment/data/a.txt")
+
+
+def test_rm_later_runs_after_the_writes_queued_before_it(bucket, queue):
+    bucket.failing = True
+    fs = write_behind.DeferredFileSystem(queue)
+    with fs.open("annotation-experiment/data/a.txt", "w") as f:
+        f.write("a")
+    fs.rm_later("annotation-experiment/data/a.txt")
+    assert not fs.exists("annotation-experiment/data/a.txt")
+    assert fs.glob("annotation-experiment/data/*.txt") == []
+    with pytest.raises(FileNotFoundError):
+        fs.open("annotation-experiment/data/a.txt")
+
+    bucket.failing = False
+    assert queue.flush(timeout=10)
+    assert not bucket.exists("annotation-experiment/data/a.txt")
+
+
+def test_write_now_falls_back_to_the_queue(bucket, queue):
+    fs = write_behind.DeferredFileSystem(queue)
+    bucket.failing = True
+    with pytest.raises(OSError):
+        fs.write_now("annotation-experiment/data/a.txt", "a")
+    assert fs.open("annotation-experiment/data/a.txt").read() == "a"
+    bucket.failing = False
+    assert queue.flush(timeout=10)
+    assert bucket.open("annotation-experiment/data/a.txt").read() == "a"
+
+
+def test_spooled_writes_survive_a_restart(bucket, tmp_path):
+    spool = str(tmp_path / "spool")
+    bucket.failing = True
+    queue = write_behind.WriteBehindQueue(bucket, spool_folder=spool)
+    queue.write("annotation-experiment/data/a.txt", "a")
+    queue.close(timeout=0)
+    assert os.listdir(spool)
+
+    bucket.failing = False
+    queue = write_behind.WriteBehindQueue(bucket, spool_folder=spool)
+    assert queue.flush(timeout=10)
+    queue.close()
+    assert bucket.open("annotation-experiment/data/a.txt").read() == "a"
+    assert not os.listdir(spool)
+
+
+def test_pending_writes_are_uploaded_at_exit(tmp_path):
+    # the executors of the interpreter are shut down before atexit hooks run,
+    # so the queue has to drain the last writes without its pool
+    script = textwrap.dedent(
+        f"""
+        import sys, time
+        sys.path.insert(0, {ROOT!r})
+        import storage, write_behind
+
+        class SlowStorage(storage.LocalStorage):
+            def open(self, path, mode="r"):
+                time.sleep(0.005)
+                return super().open(path, mode)
+
+        queue = write_behind.WriteBehindQueue(
+            SlowStorage({str(tmp_path / "bucket")!r}),
+            spool_folder={str(tmp_path / "spool")!r},
+        )
+        for i in range(100):
+            queue.write(f"annotation-experiment/data/{{i % 4}}/{{i}}.txt", str(i))
+        """
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    assert "Traceback" not in result.stderr
+    assert os.listdir(tmp_path / "spool") == []
+    uploaded = [name for _, _, names in os.walk(tmp_path / "bucket") for name in names]
+    assert len(uploaded) == 100
@@ -0,0 +1,328 @@
+"""
+Write-behind queue for bucket writes.
+
+A write is first saved as a small JSON file in a local spool folder and queued;
+the caller returns right away. A background thread drains the queue in
+batches and uploads the writes, retrying failed ones with exponential backoff.
+Writes that share a key (by default the folder they go to, i.e. one worker's
+progress records) are uploaded in the order they were made. Spooled writes
+left over by a previous process are queued again on start-up, and the queue
+is flushed when the interpreter exits.
+
+`DeferredFileSystem` puts the queue behind the `open/exists/glob/rm` calls the
+rest of the code uses, and serves pending writes back to readers so a session
+always sees its own writes. Deletions can be queued too, with `rm_later`; they
+run after the writes of their key queued before them. Data that must reach the bucket before something
+else is deleted, such as a snapshot replacing the shards it folds, is written
+with `write_now` instead, which doesn't go through the queue.
+"""
+
+import atexit
+import io
+import itertools
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from time import sleep, time_ns
+
+SPOOL_FOLDER = "data/pending_writes"
+BATCH_SIZE = 50
+MAX_WORKERS = 4  # keys flushed in parallel within a batch
+RETRY_DELAY = 1.0  # seconds, doubled after every failed batch
+MAX_RETRY_DELAY = 60.0
+
+
+class WriteBehindQueue:
+    def __init__(
+        self,
+        fs,
+        spool_folder: str = SPOOL_FOLDER,
+        batch_size: int = BATCH_SIZE,
+        max_workers: int = MAX_WORKERS,
+    ):
+        self.fs = fs
+        self.spool_folder = spool_folder
+        self.batch_size = batch_size
+        self._queue = deque()
+        self._pending = {}  # path -> latest entry not yet uploaded
+        self._count = 0  # entries queued or being uploaded
+        self._seq = itertools.count()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        os.makedirs(spool_folder, exist_ok=True)
+        for name in sorted(os.listdir(spool_folder)):
+            if not name.endswith(".json"):
+                continue
+            spool = os.path.join(spool_folder, name)
+            with open(spool) as f:
+                entry = json.load(f)
+            entry["spool"] = spool
+            self._enqueue(entry)
+
+        self._thread = threading.Thread(
+            target=self._run, name="write-behind", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _enqueue(self, entry: dict):
+        entry["cancelled"] = False
+        with self._cond:
+            self._queue.append(entry)
+            self._pending[entry["path"]] = entry
+            self._count += 1
+            self._cond.notify_all()
+
+    def write(self, path: str, data: str, key: str = None):
+        """
+        Spool `data` for `path` and queue it for upload; None as `data` queues
+        the deletion of `path` instead.
+        """
+        entry = {
+            "path": path,
+            "data": data,
+            "key": key if key is not None else os.path.dirname(path),
+        }
+        name = f"{time_ns():020d}_{next(self._seq):06d}.json"
+        spool = os.path.join(self.spool_folder, name)
+        with open(f"{spool}.tmp", "w") as f:
+            json.dump(entry, f)
+        os.replace(f"{spool}.tmp", spool)
+        entry["spool"] = spool
+        self._enqueue(entry)
+
+    def delete(self, path: str, key: str = None):
+        self.write(path, None, key)
+
+    def pending_entry(self, path: str):
+        with self._cond:
+            return self._pending.get(path)
+
+    def pending_paths(self) -> list:
+        with self._cond:
+            return list(self._pending)
+
+    def cancel(self, path: str) -> bool:
+        """
+        Drop a queued write for `path`. Returns whether there was one.
+        """
+        with self._cond:
+            entry = self._pending.pop(path, None)
+            if entry is None:
+                return False
+            entry["cancelled"] = True
+            return True
+
+    def pending(self) -> int:
+        with self._cond:
+            return self._count
+
+    def _done(self, entry: dict):
+        try:
+            os.remove(entry["spool"])
+        except FileNotFoundError:
+            pass
+        with self._cond:
+            if self._pending.get(entry["path"]) is entry:
+                del self._pending[entry["path"]]
+            self._count -= 1
+            self._cond.notify_all()
+
+    def _flush_group(self, entries: list) -> list:
+        """
+        Upload one key's entries in order; return the ones left after a failure.
+        """
+        for i, entry in enumerate(entries):
+            if not entry["cancelled"]:
+                try:
+                    if entry["data"] is None:
+                        if self.fs.exists(entry["path"]):
+                            self.fs.rm([entry["path"]])
+                    else:
+                        with self.fs.open(entry["path"], "w") as f:
+                            f.write(entry["data"])
+                except Exception:
+                    return entries[i:]
+            self._done(entry)
+        return []
+
+    def _flush_groups(self, groups: list) -> list:
+        """
+        Upload the groups in parallel; return the entries left after failures.
+        """
+        futures = []
+        failed = []
+        for group in groups:
+            try:
+                futures.append(self._executor.submit(self._flush_group, group))
+            except RuntimeError:
+                # at interpreter exit executors refuse new work before the
+                # atexit hook closing the queue runs, so drain on this thread
+                failed.extend(self._flush_group(group))
+        for future in futures:
+            failed.extend(future.result())
+        return failed
+
+    def _run(self):
+        delay = RETRY_DELAY
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                batch = [
+                    self._queue.popleft()
+                    for _ in range(min(self.batch_size, len(self._queue)))
+                ]
+
+            groups = OrderedDict()
+            for entry in batch:
+                groups.setdefault(entry["key"], []).append(entry)
+            failed = self._flush_groups(list(groups.values()))
+
+            if failed:
+                with self._cond:
+                    self._queue.extendleft(reversed(failed))
+                    if self._closed:
+                        return  # leave them in the spool for the next start
+                sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+            else:
+                delay = RETRY_DELAY
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until every queued write is uploaded. Returns whether it was.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._count == 0, timeout)
+
+    def close(self, timeout: float = 30):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=False)
+
+
+def write_now(fs, path: str, data: str):
+    """
+    Write `path` synchronously, also when `fs` is a DeferredFileSystem.
+    """
+    if hasattr(fs, "write_now"):
+        fs.write_now(path, data)
+        return
+    with fs.open(path, "w") as f:
+        f.write(data)
+
+
+def rm_later(fs, paths):
+    """
+    Queue the deletion of `paths` when `fs` is a DeferredFileSystem, otherwise
+    delete them now.
+    """
+    if hasattr(fs, "rm_later"):
+        fs.rm_later(paths)
+        return
+    fs.rm(paths)
+
+
+class _DeferredFile(io.StringIO):
+    def __init__(self, queue: WriteBehindQueue, path: str):
+        super().__init__()
+        self._write_queue = queue
+        self._path = path
+
+    def close(self):
+        if not self.closed:
+            self._write_queue.write(self._path, self.getvalue())
+        super().close()
+
+
+class DeferredFileSystem:
+    """
+    File system facade whose text writes go through a WriteBehindQueue.
+    """
+
+    def __init__(self, queue: WriteBehindQueue):
+        self.queue = queue
+        self.fs = queue.fs
+
+    def open(self, path: str, mode: str = "r"):
+        if mode == "w":
+            return _DeferredFile(self.queue, path)
+        entry = self.queue.pending_entry(path)
+        if entry is not None and entry["data"] is None:
+            raise FileNotFoundError(path)  # its deletion is queued
+        if entry is not None and mode == "r":
+            return io.StringIO(entry["data"])
+        return self.fs.open(path, mode)
+
+    def write_now(self, path: str, data: str):
+        """
+        Upload `path` right away, replacing a queued write of it. If the upload
+        fails the data is queued instead and the error raised.
+        """
+        self.queue.cancel(path)
+        try:
+            write_now(self.fs, path, data)
+        except Exception:
+            self.queue.write(path, data)
+            raise
+
+    def exists(self, path: str) -> bool:
+        entry = self.queue.pending_entry(path)
+        if entry is not None:
+            return entry["data"] is not None
+        return self.fs.exists(path)
+
+    def info(self, path: str) -> dict:
+        entry = self.queue.pending_entry(path)
+        if entry is not None and entry["data"] is None:
+            raise FileNotFoundError(path)
+        if entry is not None:
+            return {
+                "name": path,
+                "size": len(entry["data"]),
+                "generation": entry["spool"],
+            }
+        return self.fs.info(path)
+
+    def glob(self, pattern: str) -> list:
+        written, deleted = set(), set()
+        for path in self.queue.pending_paths():
+            entry = self.queue.pending_entry(path)
+            if entry is not None and fnmatch(path, pattern):
+                (deleted if entry["data"] is None else written).add(path)
+        return sorted((set(self.fs.glob(pattern)) - deleted) | written)
+
+    def rm(self, paths):
+        if isinstance(paths, str):
+            paths = [paths]
+        uploaded = []
+        for path in paths:
+            entry = self.queue.pending_entry(path)
+            if not self.queue.cancel(path):
+                uploaded.append(path)
+            elif entry is not None and entry["data"] is None and self.fs.exists(path):
+                uploaded.append(path)  # its queued deletion hadn't run yet
+        if uploaded:
+            self.fs.rm(uploaded)
+
+    def rm_later(self, paths):
+        """
+        Queue the deletion of `paths`, after the writes queued before it.
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        for path in paths:
+            self.queue.delete(path)
+
+    def __getattr__(self, name):
+        return getattr(self.fs, name)